@@ -15,17 +15,49 @@ import sys
 import numpy as np
 import os
 import math
+import time
+import warnings
 
 import constants as c
 from farq import FarquharC3
 from penman_monteith_leaf import PenmanMonteith
+import batch_kernels
+from solver_log import CONVERGED, FAILED, COLD_RESTART
+
+class ConvergenceError(Exception):
+    """Tleaf didn't settle within iter_max iterations."""
+
+    def __init__(self, msg, iter=None, residual=None):
+        Exception.__init__(self, msg)
+        self.iter = iter
+        self.residual = residual
+
+    def __reduce__(self):
+        # so it survives being passed back from a worker process
+        return (ConvergenceError, (self.args[0], self.iter, self.residual))
 
 class CoupledModel(object):
     """Iteratively solve leaf temp, Ci, gs and An."""
 
+    # Parameters that can be given as an array, one value per row solved,
+    # and where each one lives in the solvers from get_solvers
+    ROW_PARAMS = {
+        "g0": "F", "g1": "F", "D0": "F", "gamma": "F", "alpha": "F",
+        "Vcmax25": "photo", "Jmax25": "photo", "Rd25": "photo",
+        "Eaj": "photo", "Eav": "photo", "deltaSj": "photo",
+        "deltaSv": "photo", "Hdv": "photo", "Hdj": "photo", "Q10": "photo",
+        "leaf_width": "P", "leaf_absorptance": "P",
+    }
+
+    # rows main_batch checks the array kernels against the scalar ones on,
+    # and below how many rows the numpy overhead means it isn't worth it
+    BATCH_CHECK = 16
+    BATCH_MIN = 32
+
     def __init__(self, g0, g1, D0, gamma, Vcmax25, Jmax25, Rd25, Eaj, Eav,
                  deltaSj, deltaSv, Hdv, Hdj, Q10, leaf_width, SW_abs,
-                 gs_model, alpha=None, leaf_absorptance=0.5, iter_max=100):
+                 gs_model, alpha=None, leaf_absorptance=0.5, iter_max=100,
+                 g0_func=None, log=None):
 
         # set params
         self.g0 = g0
@@ -48,9 +80,107 @@ class CoupledModel(object):
         self.gs_model = gs_model
         self.iter_max = iter_max
 
+        # function of air temperature (K), e.g. from temperature_response,
+        # giving g0 for each timestep in place of the fixed g0
+        self.g0_func = g0_func
+
         self.emissivity_leaf = 0.99   # emissivity of leaf (-)
         self.leaf_absorptance = leaf_absorptance # leaf abs of solar rad [0,1]
 
+        # SolverLog to record iterations, residuals etc. of each row in, off
+        # if None
+        self._log = log
+
+    def __setattr__(self, name, value):
+        # Changing any parameter invalidates the pre-built solvers
+        if not name.startswith("_"):
+            self.__dict__["_solvers"] = None
+        object.__setattr__(self, name, value)
+
+    def get_solvers(self):
+        """
+        Return the FarquharC3 & PenmanMonteith instances (and the fixed
+        photosynthesis keyword args) for the current parameters, building
+        them only the first time after a parameter has changed.
+
+        Returns:
+        --------
+        solvers : tuple
+            (FarquharC3 instance, PenmanMonteith instance, dict of the
+            parameter kwargs passed to calc_photosynthesis)
+        """
+        if self._solvers is None:
+            F = FarquharC3(theta_J=0.85, peaked_Jmax=True, peaked_Vcmax=True,
+                           model_Q10=True, gs_model=self.gs_model,
+                           gamma=self.gamma, g0=self.g0,
+                           g1=self.g1, D0=self.D0, alpha=self.alpha)
+            P = PenmanMonteith(self.leaf_width, self.leaf_absorptance)
+            photo_params = dict(Jmax25=self.Jmax25, Vcmax25=self.Vcmax25,
+                                Q10=self.Q10, Eaj=self.Eaj, Eav=self.Eav,
+                                deltaSj=self.deltaSj, deltaSv=self.deltaSv,
+                                Rd25=self.Rd25, Hdv=self.Hdv, Hdj=self.Hdj)
+            self._solvers = (F, P, photo_params)
+
+            # worked out here so the solvers needn't check every call
+            self._per_row = [name for name in self.ROW_PARAMS
+                             if np.ndim(getattr(self, name)) > 0]
+
+        return self._solvers
+
+    def get_g0(self, tair):
+        """
+        g0 for each timestep from g0_func, None if g0 is fixed. Evaluated
+        once for all the timesteps, rather than per iteration.
+        """
+        if self.g0_func is None:
+            return None
+
+        tair = np.asarray(tair, dtype=np.float64)
+        return np.broadcast_to(self.g0_func(tair + c.DEG_2_KELVIN),
+                               tair.shape)
+
+    def get_row_params(self, tair):
+        """
+        Parameters that vary by row, i.e. those in ROW_PARAMS given as
+        arrays and g0 from g0_func, each broadcast to the shape of tair.
+
+        Returns:
+        --------
+        row_params : list
+            (name, array) pairs, empty if every parameter is fixed
+        """
+        self.get_solvers()
+        if not self._per_row and self.g0_func is None:
+            return []
+
+        tair = np.atleast_1d(np.asarray(tair, dtype=np.float64))
+        row_params = []
+        for name in self._per_row:
+            value = getattr(self, name)
+            try:
+                value = np.broadcast_to(np.asarray(value, dtype=np.float64),
+                                        tair.shape)
+            except ValueError:
+                raise ValueError("%s has %d values for %d rows" %
+                                 (name, np.size(value), tair.size))
+            row_params.append((name, value))
+
+        g0 = self.get_g0(tair)
+        if g0 is not None:
+            row_params = [(k, v) for (k, v) in row_params if k != "g0"]
+            row_params.append(("g0", g0))
+
+        return row_params
+
+    def set_row(self, solvers, row_params, i):
+        """ Put row i of the row-varying parameters into the solvers """
+        (F, P, photo_params) = solvers
+        for (name, values) in row_params:
+            where = self.ROW_PARAMS[name]
+            if where == "photo":
+                photo_params[name] = values[i]
+            else:
+                setattr(F if where == "F" else P, name, values[i])
 
     def main(self, tair, par, vpd, wind, pressure, Ca, Topt_hack=False):
         """
@@ -80,81 +210,451 @@ class CoupledModel(object):
             transpiration (mol H2O m-2 s-1)
         """
 
-        F = FarquharC3(theta_J=0.85, peaked_Jmax=True, peaked_Vcmax=True,
-                       model_Q10=True, gs_model=self.gs_model,
-                       gamma=self.gamma, g0=self.g0,
-                       g1=self.g1, D0=self.D0, alpha=self.alpha)
-        P = PenmanMonteith(self.leaf_width, self.leaf_absorptance)
+        solvers = self.get_solvers()
+        row_params = self.get_row_params(tair)
+        if row_params:
+            self.set_row(solvers, row_params, 0)
+        log = self._log
+        if log is not None:
+            start = time.perf_counter()
 
         # set initialise values
         dleaf = vpd
-        dair = vpd
         Cs = Ca
         Tleaf = tair
-        Tleaf_K = Tleaf + c.DEG_2_KELVIN
+
+        try:
+            (An, gsc, et, le_et, Tleaf, Cs, dleaf,
+             iter, resid) = self.iterate(solvers, tair, par, vpd, wind,
+                                         pressure, Ca, Tleaf, Cs, dleaf,
+                                         Topt_hack)
+        except ConvergenceError as e:
+            if log is not None:
+                log.record(e.iter, e.residual, time.perf_counter() - start,
+                           FAILED)
+            raise
+        if log is not None:
+            log.record(iter, resid, time.perf_counter() - start, CONVERGED)
+
+        gsw = gsc * c.GSC_2_GSW
+
+        return (An, gsw, et, le_et)
+
+    def iterate(self, solvers, tair, par, vpd, wind, pressure, Ca, Tleaf, Cs,
+                dleaf, Topt_hack=False):
+        """
+        The fixed-point iteration behind main, starting from the supplied
+        Tleaf (deg C), Cs and dleaf (kPa).
+
+        Returns:
+        --------
+        An, gsc, et, le_et : float
+            as from step on the final iteration
+        Tleaf, Cs, dleaf : float
+            converged state, can be used to start the next timestep
+        iter : int
+            number of iterations taken
+        resid : float
+            final |Tleaf - new Tleaf| (deg C)
+        """
+        dair = vpd
 
         #print "Start: %.3f %.3f %.3f" % (Cs, Tleaf, dleaf)
         #print
 
-        Topt = 35.0
-        Topt_K = Topt + c.DEG_2_KELVIN
         iter = 0
         while True:
-            (An, gsc) = F.calc_photosynthesis(Cs=Cs, Tleaf=Tleaf_K, Par=par,
-                                              Jmax25=self.Jmax25,
-                                              Vcmax25=self.Vcmax25,
-                                              Q10=self.Q10, Eaj=self.Eaj,
-                                              Eav=self.Eav,
-                                              deltaSj=self.deltaSj,
-                                              deltaSv=self.deltaSv,
-                                              Rd25=self.Rd25, Hdv=self.Hdv,
-                                              Hdj=self.Hdj, vpd=dleaf)
-
-            if Topt_hack:
-                if Tleaf > Topt:
-                    (Anx, gsc) = F.calc_photosynthesis(Cs=Cs, Tleaf=Topt_K, Par=par,
-                                                      Jmax25=self.Jmax25,
-                                                      Vcmax25=self.Vcmax25,
-                                                      Q10=self.Q10, Eaj=self.Eaj,
-                                                      Eav=self.Eav,
-                                                      deltaSj=self.deltaSj,
-                                                      deltaSv=self.deltaSv,
-                                                      Rd25=self.Rd25, Hdv=self.Hdv,
-                                                      Hdj=self.Hdj, vpd=dleaf)
-
-
-            # Calculate new Tleaf, dleaf, Cs
-            (new_tleaf, et,
-             le_et, gbH, gw) = self.calc_leaf_temp(P, Tleaf, tair, gsc,
-                                                   par, vpd, pressure, wind)
-
-
-            gbc = gbH * c.GBH_2_GBC
-            Cs = Ca - An / gbc # boundary layer of leaf
-            if et == 0.0 or gw == 0.0:
-                dleaf = dair
-            else:
-                dleaf = (et * pressure / gw) * c.PA_2_KPA # kPa
-
+            (An, gsc, new_tleaf, et,
+             le_et, Cs, dleaf) = self.step(solvers, Tleaf, tair, par, vpd,
+                                           dair, dleaf, Cs, pressure, wind,
+                                           Ca, Topt_hack)
 
             #print "%f %f %f %f %f %f" %  (Cs, Tleaf, dleaf, An*12.*0.000001*86400., gs, et*18*0.001*86400.)
 
             # Check for convergence...?
-            if math.fabs(Tleaf - new_tleaf) < 0.02:
+            resid = math.fabs(Tleaf - new_tleaf)
+            if resid < 0.02:
                 break
 
             if iter > self.iter_max:
-                raise Exception('No convergence: %d' % (iter))
-
+                raise ConvergenceError('No convergence: %d' % (iter), iter,
+                                       resid)
 
             # Update temperature & do another iteration
             Tleaf = new_tleaf
 
-            Tleaf_K = Tleaf + c.DEG_2_KELVIN
-
             iter += 1
         #print(Tleaf)
+
+        return (An, gsc, et, le_et, Tleaf, Cs, dleaf, iter, resid)
+
+    def main_timeseries(self, tair, par, vpd, wind, pressure, Ca,
+                        Topt_hack=False, out=None):
+        """
+        Version of main_batch for rows that are consecutive timesteps. Each
+        timestep starts from the solution of the previous one, i.e. the
+        previous leaf-air temperature difference, leaf-air VPD and Ca-Cs
+        drawdown are applied to the new forcing, which needs fewer iterations
+        than starting from Tleaf = tair. If that doesn't converge, the step
+        is re-solved from the usual cold start.
+
+        Parameters:
+        ----------
+        tair : array
+            air temperature (deg C)
+        par : array
+            Photosynthetically active radiation (umol m-2 s-1)
+        vpd : array
+            Vapour pressure deficit (kPa, needs to be in Pa, see conversion
+            below)
+        wind : float or array
+            wind speed (m s-1)
+        pressure : float or array
+            air pressure (using constant) (Pa)
+        Ca : float or array
+            ambient CO2 concentration
+        out : structured array
+            optional, a record per row with An, gsw, et, LE & Tleaf fields
+            (e.g. a row of a results_store array) the results are also
+            written to, the only way to get Tleaf back
+
+        Returns:
+        --------
+        An : array
+            net leaf assimilation (umol m-2 s-1)
+        gs : array
+            stomatal conductance (mol m-2 s-1)
+        et : array
+            transpiration (mol H2O m-2 s-1)
+        le_et : array
+            latent heat flux (W m-2)
+        """
+        (tair, par, vpd,
+         wind, pressure, Ca) = np.broadcast_arrays(*[np.atleast_1d(\
+                                            np.asarray(v, dtype=np.float64))
+                                            for v in (tair, par, vpd, wind,
+                                                      pressure, Ca)])
+        n = tair.size
+
+        solvers = self.get_solvers()
+        row_params = self.get_row_params(tair)
+        log = self._log
+        if log is not None:
+            diag = np.zeros((4, n))
+
+        An = np.zeros(n)
+        gsc = np.zeros(n)
+        et = np.zeros(n)
+        le_et = np.zeros(n)
+        leaf_temp = np.zeros(n)
+
+        prev = None
+        for i in range(n):
+            if row_params:
+                self.set_row(solvers, row_params, i)
+            if log is not None:
+                start = time.perf_counter()
+
+            (Tleaf, Cs, dleaf) = (tair[i], Ca[i], vpd[i])
+            if prev is not None:
+                (dT, dCs, dD) = prev
+                Tleaf += dT
+                Cs += dCs
+                dleaf += dD
+
+            args = (solvers, tair[i], par[i], vpd[i], wind[i], pressure[i],
+                    Ca[i])
+            status = CONVERGED
+            warm_iter = 0
+            try:
+                try:
+                    res = self.iterate(*args + (Tleaf, Cs, dleaf, Topt_hack))
+                except ConvergenceError as e:
+                    if prev is None:
+                        raise
+                    status = COLD_RESTART
+                    warm_iter = e.iter
+                    res = self.iterate(*args + (tair[i], Ca[i], vpd[i],
+                                                Topt_hack))
+            except ConvergenceError as e:
+                if log is not None:
+                    diag[:,i] = (warm_iter + e.iter, e.residual,
+                                 time.perf_counter() - start, FAILED)
+                    log.record_batch(*diag[:,:i+1])
+                raise
+
+            (An[i], gsc[i], et[i], le_et[i], Tleaf, Cs, dleaf,
+             iter, resid) = res
+            leaf_temp[i] = Tleaf
+            prev = (Tleaf - tair[i], Cs - Ca[i], dleaf - vpd[i])
+            if log is not None:
+                diag[:,i] = (warm_iter + iter, resid,
+                             time.perf_counter() - start, status)
+
+        if log is not None:
+            log.record_batch(*diag)
+
+        gsw = gsc * c.GSC_2_GSW
+        if out is not None:
+            self.write_out(out, An, gsw, et, le_et, leaf_temp)
+
+        return (An, gsw, et, le_et)
+
+    def main_batch(self, tair, par, vpd, wind, pressure, Ca,
+                   Topt_hack=False, out=None):
+        """
+        Version of main that solves a whole set of timesteps at once. Rows
+        share the fixed-point iteration, each pass being done for all the
+        rows still going at once by step_batch, and once a row has converged
+        it is dropped from subsequent iterations. If the array kernels don't
+        reproduce the Coupled_Canopy ones (see check_batch), or there are
+        fewer than BATCH_MIN rows, they are stepped one at a time instead.
+
+        Any of the parameters in ROW_PARAMS can be an array of a value per
+        row (e.g. a g1 per chamber), these are passed to the kernels as
+        arrays rather than building a model for each row.
+
+        Parameters:
+        ----------
+        tair : array
+            air temperature (deg C)
+        par : array
+            Photosynthetically active radiation (umol m-2 s-1)
+        vpd : array
+            Vapour pressure deficit (kPa, needs to be in Pa, see conversion
+            below)
+        wind : float or array
+            wind speed (m s-1)
+        pressure : float or array
+            air pressure (using constant) (Pa)
+        Ca : float or array
+            ambient CO2 concentration
+        out : structured array
+            optional, a record per row with An, gsw, et, LE & Tleaf fields
+            (e.g. a row of a results_store array) the results are also
+            written to, the only way to get Tleaf back
+
+        Returns:
+        --------
+        An : array
+            net leaf assimilation (umol m-2 s-1)
+        gs : array
+            stomatal conductance (mol m-2 s-1)
+        et : array
+            transpiration (mol H2O m-2 s-1)
+        le_et : array
+            latent heat flux (W m-2)
+        """
+        (tair, par, vpd,
+         wind, pressure, Ca) = np.broadcast_arrays(*[np.atleast_1d(\
+                                            np.asarray(v, dtype=np.float64))
+                                            for v in (tair, par, vpd, wind,
+                                                      pressure, Ca)])
+        n = tair.size
+
+        solvers = self.get_solvers()
+        row_params = self.get_row_params(tair)
+
+        # set initialise values
+        dleaf = vpd.copy()
+        dair = vpd
+        Cs = Ca.copy()
+        Tleaf = tair.copy()
+        new_tleaf = tair.copy()
+
+        An = np.zeros(n)
+        gsc = np.zeros(n)
+        et = np.zeros(n)
+        le_et = np.zeros(n)
+
+        log = self._log
+        if log is not None:
+            iters = np.zeros(n, dtype=np.int32)
+            seconds = np.zeros(n)
+
+        batch = (n >= self.BATCH_MIN and
+                 self.check_batch(solvers, row_params, tair, par, vpd, wind,
+                                  pressure, Ca, Topt_hack))
+
+        active = np.ones(n, dtype=bool)
+        iter = 0
+        while True:
+            if batch:
+                if log is not None:
+                    start = time.perf_counter()
+                rows = np.flatnonzero(active)
+                params = self.batch_params(solvers, row_params, rows)
+                (An[rows], gsc[rows], new_tleaf[rows], et[rows],
+                 le_et[rows], Cs[rows],
+                 dleaf[rows]) = self.step_batch(solvers, params, Tleaf[rows],
+                                                tair[rows], par[rows],
+                                                vpd[rows], dair[rows],
+                                                dleaf[rows], Cs[rows],
+                                                pressure[rows], wind[rows],
+                                                Ca[rows], Topt_hack)
+
+                # the rows are timed together, so share it out
+                if log is not None:
+                    seconds[rows] += (time.perf_counter() - start) / len(rows)
+            else:
+                for i in np.flatnonzero(active):
+                    if row_params:
+                        self.set_row(solvers, row_params, i)
+                    if log is not None:
+                        start = time.perf_counter()
+                    (An[i], gsc[i], new_tleaf[i], et[i],
+                     le_et[i], Cs[i], dleaf[i]) = self.step(solvers, Tleaf[i],
+                                                            tair[i], par[i],
+                                                            vpd[i], dair[i],
+                                                            dleaf[i], Cs[i],
+                                                            pressure[i],
+                                                            wind[i], Ca[i],
+                                                            Topt_hack)
+                    if log is not None:
+                        seconds[i] += time.perf_counter() - start
+
+            # Drop the rows that have converged
+            resid = np.fabs(Tleaf - new_tleaf)
+            if log is not None:
+                iters[active] = iter
+            active &= resid >= 0.02
+            if not active.any():
+                break
+
+            if iter > self.iter_max:
+                if log is not None:
+                    log.record_batch(iters, resid, seconds,
+                                     np.where(active, FAILED, CONVERGED))
+                raise ConvergenceError('No convergence: %d (%d rows)' %
+                                       (iter, np.count_nonzero(active)),
+                                       iter, resid.max())
+
+            # Update temperature & do another iteration
+            Tleaf[active] = new_tleaf[active]
+
+            iter += 1
+
+        if log is not None:
+            log.record_batch(iters, resid, seconds, CONVERGED)
+
         gsw = gsc * c.GSC_2_GSW
+        if out is not None:
+            self.write_out(out, An, gsw, et, le_et, Tleaf)
+
+        return (An, gsw, et, le_et)
+
+    def write_out(self, out, An, gsw, et, le_et, Tleaf):
+        """ Copy the results of main_batch/main_timeseries into out """
+        if len(out) != len(An):
+            raise ValueError("out has %d rows, need %d" % (len(out), len(An)))
+        out["An"] = An
+        out["gsw"] = gsw
+        out["et"] = et
+        out["LE"] = le_et
+        out["Tleaf"] = Tleaf
+
+    def main_secant(self, tair, par, vpd, wind, pressure, Ca,
+                    Topt_hack=False):
+        """
+        Version of main that treats Tleaf as the root of the energy balance
+        residual, new_tleaf(Tleaf) - Tleaf, rather than iterating on it
+        directly. Secant steps are kept inside a bracket on the root (falling
+        back to bisection), which needs a handful of iterations and doesn't
+        throw if it can't converge, the best estimate is returned instead,
+        with a warning (or a FAILED entry if a SolverLog is attached).
+
+        Parameters:
+        ----------
+        tair : float
+            air temperature (deg C)
+        par : float
+            Photosynthetically active radiation (umol m-2 s-1)
+        vpd : float
+            Vapour pressure deficit (kPa, needs to be in Pa, see conversion
+            below)
+        wind : float
+            wind speed (m s-1)
+        pressure : float
+            air pressure (using constant) (Pa)
+        Ca : float
+            ambient CO2 concentration
+
+        Returns:
+        --------
+        An : float
+            net leaf assimilation (umol m-2 s-1)
+        gs : float
+            stomatal conductance (mol m-2 s-1)
+        et : float
+            transpiration (mol H2O m-2 s-1)
+        """
+        solvers = self.get_solvers()
+        row_params = self.get_row_params(tair)
+        if row_params:
+            self.set_row(solvers, row_params, 0)
+        log = self._log
+        if log is not None:
+            start = time.perf_counter()
+
+        # Cs and dleaf lag one evaluation behind, as in main
+        dair = vpd
+        state = {"Cs": Ca, "dleaf": vpd}
+
+        def residual(Tleaf):
+            out = self.step(solvers, Tleaf, tair, par, vpd, dair,
+                            state["dleaf"], state["Cs"], pressure, wind, Ca,
+                            Topt_hack)
+            state["Cs"] = out[5]
+            state["dleaf"] = out[6]
+            return (out[2] - Tleaf, out)
+
+        # root lies above lo (residual > 0) and below hi (residual < 0)
+        lo = hi = None
+        Tleaf = tair
+        (r, out) = residual(Tleaf)
+        best = (math.fabs(r), out)
+        prev = None
+        iter = 0
+        while math.fabs(r) >= 0.02 and iter <= self.iter_max:
+            if r > 0.0:
+                lo = Tleaf if lo is None else max(lo, Tleaf)
+            else:
+                hi = Tleaf if hi is None else min(hi, Tleaf)
+            if lo is not None and hi is not None and hi - lo < 1E-04:
+                break
+
+            new_tleaf = Tleaf + r
+            if prev is not None and r != prev[1]:
+                secant = Tleaf - r * (Tleaf - prev[0]) / (r - prev[1])
+
+                # Cs & dleaf lag, so early on the secant can point the wrong
+                # way, in which case stick with the fixed-point step
+                if (secant - Tleaf) * r > 0.0:
+                    new_tleaf = secant
+
+            # keep within the bracket and don't jump miles without one
+            if lo is not None and hi is not None:
+                if not lo < new_tleaf < hi:
+                    new_tleaf = 0.5 * (lo + hi)
+            else:
+                new_tleaf = min(max(new_tleaf, Tleaf - 10.0), Tleaf + 10.0)
+
+            prev = (Tleaf, r)
+            Tleaf = new_tleaf
+            (r, out) = residual(Tleaf)
+            if math.fabs(r) < best[0]:
+                best = (math.fabs(r), out)
+            iter += 1
+
+        (An, gsc, new_tleaf, et, le_et, Cs, dleaf) = best[1]
+        gsw = gsc * c.GSC_2_GSW
+
+        if log is not None:
+            log.record(iter, best[0], time.perf_counter() - start,
+                       CONVERGED if best[0] < 0.02 else FAILED)
+        elif best[0] >= 0.02:
+            warnings.warn("main_secant didn't converge (Tleaf residual "
+                          "%.3g), returning its best estimate" % (best[0]))
 
         return (An, gsw, et, le_et)
 
@@ -188,11 +688,11 @@ class CoupledModel(object):
             transpiration (mol H2O m-2 s-1)
         """
 
-        F = FarquharC3(theta_J=0.85, peaked_Jmax=True, peaked_Vcmax=True,
-                       model_Q10=True, gs_model=self.gs_model,
-                       gamma=self.gamma, g0=self.g0,
-                       g1=self.g1, D0=self.D0, alpha=self.alpha)
-        P = PenmanMonteith(self.leaf_width, self.leaf_absorptance)
+        solvers = self.get_solvers()
+        (F, P, photo_params) = solvers
+        row_params = self.get_row_params(tair)
+        if row_params:
+            self.set_row(solvers, row_params, 0)
 
         # set initialise values
         dleaf = vpd
@@ -202,14 +702,7 @@ class CoupledModel(object):
         Tleaf_K = Tleaf + c.DEG_2_KELVIN
 
         (An, gsc) = F.calc_photosynthesis(Cs=Cs, Tleaf=Tleaf_K, Par=par,
-                                          Jmax25=self.Jmax25,
-                                          Vcmax25=self.Vcmax25,
-                                          Q10=self.Q10, Eaj=self.Eaj,
-                                          Eav=self.Eav,
-                                          deltaSj=self.deltaSj,
-                                          deltaSv=self.deltaSv,
-                                          Rd25=self.Rd25, Hdv=self.Hdv,
-                                          Hdj=self.Hdj, vpd=dleaf)
+                                          vpd=dleaf, **photo_params)
 
         # Solve new Tleaf
         from scipy import optimize
@@ -218,14 +711,7 @@ class CoupledModel(object):
         #print(Tleaf)
         Tleaf_K = Tleaf + c.DEG_2_KELVIN
         (An, gsc) = F.calc_photosynthesis(Cs=Cs, Tleaf=Tleaf_K, Par=par,
-                                          Jmax25=self.Jmax25,
-                                          Vcmax25=self.Vcmax25,
-                                          Q10=self.Q10, Eaj=self.Eaj,
-                                          Eav=self.Eav,
-                                          deltaSj=self.deltaSj,
-                                          deltaSv=self.deltaSv,
-                                          Rd25=self.Rd25, Hdv=self.Hdv,
-                                          Hdj=self.Hdj, vpd=dleaf)
+                                          vpd=dleaf, **photo_params)
 
         # Clunking, but I can't be arsed to rewrite, need to get other vars
         # back
@@ -251,6 +737,168 @@ class CoupledModel(object):
                                                    wind)
         return (new_tleaf - old_Tleaf)**2
 
+    def step(self, solvers, Tleaf, tair, par, vpd, dair, dleaf, Cs, pressure,
+             wind, Ca, Topt_hack=False):
+        """
+        Single pass of the An-gs-Tleaf fixed-point iteration, shared by main
+        and main_batch. solvers is the tuple from get_solvers.
+
+        Returns:
+        --------
+        An, gsc, new_tleaf, et, le_et : float
+            as from calc_photosynthesis & calc_leaf_temp
+        Cs : float
+            CO2 concentration at the leaf surface for the next pass
+        dleaf : float
+            leaf-to-air vapour pressure deficit for the next pass (kPa)
+        """
+        (F, P, photo_params) = solvers
+        Tleaf_K = Tleaf + c.DEG_2_KELVIN
+        Topt = 35.0
+        Topt_K = Topt + c.DEG_2_KELVIN
+
+        (An, gsc) = F.calc_photosynthesis(Cs=Cs, Tleaf=Tleaf_K, Par=par,
+                                          vpd=dleaf, **photo_params)
+
+        if Topt_hack:
+            if Tleaf > Topt:
+                (Anx, gsc) = F.calc_photosynthesis(Cs=Cs, Tleaf=Topt_K, Par=par,
+                                                  vpd=dleaf, **photo_params)
+
+        # Calculate new Tleaf, dleaf, Cs
+        (new_tleaf, et,
+         le_et, gbH, gw) = self.calc_leaf_temp(P, Tleaf, tair, gsc,
+                                               par, vpd, pressure, wind)
+
+        gbc = gbH * c.GBH_2_GBC
+        Cs = Ca - An / gbc # boundary layer of leaf
+        if et == 0.0 or gw == 0.0:
+            dleaf = dair
+        else:
+            dleaf = (et * pressure / gw) * c.PA_2_KPA # kPa
+
+        return (An, gsc, new_tleaf, et, le_et, Cs, dleaf)
+
+    def check_batch(self, solvers, row_params, tair, par, vpd, wind, pressure,
+                    Ca, Topt_hack=False):
+        """
+        Whether step_batch (the array kernels) agrees with step (the
+        Coupled_Canopy kernels) on the first pass of a sample of the rows.
+        If not, e.g. with a Coupled_Canopy version that does something
+        differently, main_batch steps the rows one at a time.
+        """
+        rows = np.unique(np.linspace(0, tair.size - 1,
+                                     min(tair.size, self.BATCH_CHECK)
+                                     ).astype(int))
+        args = (tair, tair, par, vpd, vpd, vpd, Ca, pressure, wind, Ca)
+        try:
+            params = self.batch_params(solvers, row_params, rows)
+            batch = np.array(self.step_batch(solvers, params,
+                                             *[v[rows] for v in args],
+                                             Topt_hack=Topt_hack))
+        except (AttributeError, ValueError) as e:
+            warnings.warn("Array kernels failed (%s), solving row by row" %
+                          (e))
+            return False
+
+        scalar = np.zeros_like(batch)
+        for j, i in enumerate(rows):
+            if row_params:
+                self.set_row(solvers, row_params, i)
+            scalar[:,j] = self.step(solvers, *[v[i] for v in args],
+                                    Topt_hack=Topt_hack)
+
+        if not np.allclose(batch, scalar, rtol=1E-06, atol=1E-12,
+                           equal_nan=True):
+            warnings.warn("Array kernels don't match the Coupled_Canopy "
+                          "ones, solving row by row")
+            return False
+
+        return True
+
+    def batch_params(self, solvers, row_params, rows):
+        """
+        The ROW_PARAMS for step_batch, the given rows of those that vary by
+        row and the solvers' values of the rest
+        """
+        (F, P, photo_params) = solvers
+        params = {}
+        for name, where in self.ROW_PARAMS.items():
+            if where == "photo":
+                params[name] = photo_params[name]
+            else:
+                params[name] = getattr(F if where == "F" else P, name)
+        for (name, values) in row_params:
+            params[name] = values[rows]
+
+        return params
+
+    def step_batch(self, solvers, params, Tleaf, tair, par, vpd, dair, dleaf,
+                   Cs, pressure, wind, Ca, Topt_hack=False):
+        """
+        step for arrays of rows at once, using the array kernels. params is
+        from batch_params.
+        """
+        (F, P, photo_params) = solvers
+        Tleaf_K = Tleaf + c.DEG_2_KELVIN
+        Topt = 35.0
+        Topt_K = Topt + c.DEG_2_KELVIN
+
+        photo = dict((k, params[k]) for k in photo_params)
+        args = (params["g0"], params["g1"], params["D0"], params["alpha"])
+        (An, gsc) = batch_kernels.calc_photosynthesis(F, Cs, Tleaf_K, par,
+                                                      dleaf, *args, **photo)
+
+        if Topt_hack:
+            hot = Tleaf > Topt
+            if hot.any():
+                (Anx, gsc_opt) = batch_kernels.calc_photosynthesis(
+                                    F, Cs, np.full_like(Tleaf_K, Topt_K),
+                                    par, dleaf, *args, **photo)
+                gsc = np.where(hot, gsc_opt, gsc)
+
+        # Calculate new Tleaf, dleaf, Cs
+        (new_tleaf, et,
+         le_et, gbH, gw) = self.calc_leaf_temp_batch(P, params, Tleaf, tair,
+                                                     gsc, par, vpd, pressure,
+                                                     wind)
+
+        gbc = gbH * c.GBH_2_GBC
+        Cs = Ca - An / gbc # boundary layer of leaf
+        with np.errstate(divide="ignore", invalid="ignore"):
+            dleaf = np.where((et == 0.0) | (gw == 0.0), dair,
+                             (et * pressure / gw) * c.PA_2_KPA) # kPa
+
+        return (An, gsc, new_tleaf, et, le_et, Cs, dleaf)
+
+    def calc_leaf_temp_batch(self, P, params, tleaf, tair, gsc, par, vpd,
+                             pressure, wind):
+        """ calc_leaf_temp for arrays of rows, see step_batch """
+        tleaf_k = tleaf + c.DEG_2_KELVIN
+        tair_k = tair + c.DEG_2_KELVIN
+
+        # convert from mm s-1 to mol m-2 s-1
+        cmolar = pressure / (c.RGAS * tair_k)
+
+        # W m-2 = J m-2 s-1
+        rnet = batch_kernels.calc_rnet(par, tair, tair_k, vpd,
+                                       params["leaf_absorptance"])
+
+        (grn, gh,
+         gbH, gw) = batch_kernels.calc_conductances(P, tair_k, tleaf, tair,
+                                                    wind, gsc, cmolar,
+                                                    params["leaf_width"])
+        (et, le_et) = batch_kernels.calc_et(tair, vpd, pressure, gh, gw, rnet)
+        et = np.where(gsc == 0.0, 0.0, et)
+        le_et = np.where(gsc == 0.0, 0.0, le_et)
+
+        # as calc_leaf_temp
+        Y = 1.0 / (1.0 + (2.0 * grn) / (2.0 * gbH))
+        H = Y * (rnet - le_et)
+        new_Tleaf = tair + H / (c.CP * c.AIR_MASS * gh)
+
+        return (new_Tleaf, et, le_et, gbH, gw)
+
     def calc_leaf_temp(self, P=None, tleaf=None, tair=None, gsc=None, par=None,
                        vpd=None, pressure=None, wind=None):
         """
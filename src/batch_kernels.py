@@ -0,0 +1,182 @@
+#!/usr/bin/env python
+
+"""
+Array versions of the Coupled_Canopy FarquharC3 & PenmanMonteith
+calculations that CoupledModel.step makes, so main_batch can do a whole set
+of rows in one go rather than calling the scalar kernels row by row.
+
+The fixed constants (Kc25, Ec, Oi, theta_J, emissivity_leaf, ...) are read
+off the solver instances, the parameters that can vary by row are passed
+in. If a Coupled_Canopy version computes something differently from these,
+CoupledModel.main_batch notices (it checks a sample of rows against the
+scalar kernels) and falls back to solving row by row.
+"""
+
+import numpy as np
+
+import constants as c
+from temperature_response import arrh, peaked_arrh, q10
+
+__author__  = "Martin De Kauwe"
+__version__ = "1.0 (18.10.2026)"
+__email__   = "mdekauwe@gmail.com"
+
+def calc_photosynthesis(F, Cs, Tleaf, Par, vpd, g0, g1, D0, alpha, Jmax25,
+                        Vcmax25, Q10, Eaj, Eav, deltaSj, deltaSv, Rd25, Hdv,
+                        Hdj):
+    """
+    FarquharC3.calc_photosynthesis over arrays.
+
+    Parameters:
+    ----------
+    F : object
+        FarquharC3 instance, for the fixed constants & options
+    Cs : array
+        CO2 concentration at the leaf surface (umol mol-1)
+    Tleaf : array
+        leaf temperature (deg K)
+    Par : array
+        Photosynthetically active radiation (umol m-2 s-1)
+    vpd : array
+        leaf-to-air vapour pressure deficit (kPa)
+    g0, g1, D0, alpha, Jmax25, ... Hdj : float or array
+        parameters, as for FarquharC3
+
+    Returns:
+    --------
+    An : array
+        net leaf assimilation (umol m-2 s-1)
+    gsc : array
+        stomatal conductance to CO2 (mol m-2 s-1)
+    """
+    Kc = arrh(F.Kc25, F.Ec, Tleaf)
+    Ko = arrh(F.Ko25, F.Eo, Tleaf)
+    Km = Kc * (1.0 + F.Oi / Ko)
+    gamma_star = arrh(F.gamstar25, F.Eag, Tleaf)
+
+    if F.peaked_Jmax:
+        Jmax = peaked_arrh(Jmax25, Eaj, Tleaf, deltaSj, Hdj)
+    else:
+        Jmax = arrh(Jmax25, Eaj, Tleaf)
+    if F.peaked_Vcmax:
+        Vcmax = peaked_arrh(Vcmax25, Eav, Tleaf, deltaSv, Hdv)
+    else:
+        Vcmax = arrh(Vcmax25, Eav, Tleaf)
+    if not F.model_Q10:
+        raise ValueError("Only the Q10 respiration model is vectorised")
+    Rd = q10(Rd25, Q10, Tleaf)
+
+    # electron transport, a function of absorbed PAR
+    J = quadratic(F.theta_J, -(alpha * Par + Jmax), alpha * Par * Jmax,
+                  large=False)
+    Vj = J / 4.0
+
+    g0 = g0 * c.GSW_2_GSC
+    if F.gs_model == "leuning":
+        gs_over_a = g1 / (Cs - gamma_star) / (1.0 + vpd / D0)
+    elif F.gs_model == "medlyn":
+        vpd = np.maximum(vpd, 0.05)
+        gs_over_a = (1.0 + g1 / np.sqrt(vpd)) / Cs
+    else:
+        raise ValueError("Unknown gs_model: %s" % (F.gs_model))
+
+    # Rubisco and electron transport limited solutions
+    Cic = solve_ci(g0, gs_over_a, Rd, Cs, gamma_star, Vcmax, Km)
+    Cij = solve_ci(g0, gs_over_a, Rd, Cs, gamma_star, Vj, 2.0 * gamma_star)
+    Ac = assim(Cic, gamma_star, Vcmax, Km)
+    Aj = assim(Cij, gamma_star, Vj, 2.0 * gamma_star)
+
+    # below the light compensation point, Ci = Cs
+    Aj_cs = assim(Cs, gamma_star, Vj, 2.0 * gamma_star)
+    Aj = np.where(Aj <= Rd + 1E-09, Aj_cs, Aj)
+
+    # hyperbolic minimum
+    A = -quadratic(1.0 - 1E-04, Ac + Aj, Ac * Aj, large=True)
+    An = A - Rd
+    gsc = np.maximum(g0, g0 + gs_over_a * An)
+
+    return (An, gsc)
+
+def solve_ci(g0, gs_over_a, rd, Cs, gamma_star, gamma_x, beta):
+    """ Ci where the gs & assimilation curves meet """
+    A = g0 + gs_over_a * (gamma_x - rd)
+    arg1 = (1. - Cs * gs_over_a) * (gamma_x - rd)
+    arg2 = g0 * (beta - Cs)
+    arg3 = gs_over_a * (gamma_x * gamma_star + beta * rd)
+    B = arg1 + arg2 - arg3
+    arg1 = -(1.0 - Cs * gs_over_a)
+    arg2 = (gamma_x * gamma_star + beta * rd)
+    arg3 = g0 * beta * Cs
+    C = arg1 * arg2 - arg3
+
+    return quadratic(A, B, C, large=True)
+
+def assim(Ci, gamma_star, a1, a2):
+    return a1 * (Ci - gamma_star) / (a2 + Ci)
+
+def quadratic(a, b, c, large=False):
+    """ Larger (or smaller) root of a x^2 + b x + c, element-wise """
+    d = b**2.0 - 4.0 * a * c
+    if np.any(d < 0.0):
+        raise ValueError('imaginary root found')
+
+    with np.errstate(divide="ignore", invalid="ignore"):
+        if large:
+            root = (-b + np.sqrt(d)) / (2.0 * a)
+        else:
+            root = (-b - np.sqrt(d)) / (2.0 * a)
+        root = np.where((a == 0.0) & (b > 0.0), -c / b, root)
+
+    return np.where((a == 0.0) & (b == 0.0), 0.0, root)
+
+def calc_esat(tair):
+    """ Saturation vapour pressure (Pa) at tair (deg C) """
+    return 613.75 * np.exp(17.502 * tair / (240.97 + tair))
+
+def calc_rnet(par, tair, tair_k, vpd, leaf_absorptance):
+    """ PenmanMonteith.calc_rnet over arrays (W m-2) """
+    ea = np.maximum(0.0, calc_esat(tair) - (vpd * c.KPA_2_PA))
+    emissivity_atm = 0.642 * (ea / tair_k)**(1.0 / 7.0)
+    net_lw = (1.0 - emissivity_atm) * c.SIGMA * tair_k**4
+
+    return leaf_absorptance * par * c.PAR_2_SW - net_lw
+
+def calc_conductances(P, tair_k, tleaf, tair, wind, gsc, cmolar, leaf_width):
+    """
+    PenmanMonteith.calc_conductances over arrays
+
+    Returns:
+    --------
+    grn, gh, gbH, gw : arrays
+        radiation, total heat, one-sided boundary layer heat and total
+        water vapour conductances (mol m-2 s-1)
+    """
+    grn = ((4.0 * c.SIGMA * tair_k**3 * P.emissivity_leaf) /
+           (c.CP * c.AIR_MASS))
+
+    # forced & free convection
+    gbHw = 0.003 * np.sqrt(wind / leaf_width) * cmolar
+    grashof_num = 1.6E8 * np.fabs(tleaf - tair) * leaf_width**3
+    gbHf = 0.5 * c.DHEAT * (grashof_num**0.25) / leaf_width * cmolar
+    gbH = gbHw + gbHf
+
+    gh = 2.0 * (gbH + grn)
+    gbv = c.GBH_2_GBW * gbH
+    gsv = gsc * c.GSC_2_GSW
+    with np.errstate(divide="ignore", invalid="ignore"):
+        gw = (gbv * gsv) / (gbv + gsv)
+
+    return (grn, gh, gbH, gw)
+
+def calc_et(tair, vpd, pressure, gh, gw, rnet):
+    """ PenmanMonteith.calc_et over arrays, (et mol m-2 s-1, LE W m-2) """
+    lambda_et = (c.H2OLV0 - 2.365E3 * tair) * c.H2OMW
+    slope = (calc_esat(tair + 0.1) - calc_esat(tair)) / 0.1
+    gamma = c.CP * c.AIR_MASS * pressure / lambda_et
+
+    arg1 = (slope * rnet + (vpd * c.KPA_2_PA) * gh * c.CP * c.AIR_MASS)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        arg2 = slope + gamma * gh / gw
+        LE = arg1 / arg2
+
+    return (LE / lambda_et, LE)
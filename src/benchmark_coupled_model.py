@@ -0,0 +1,343 @@
+#!/usr/bin/env python
+
+"""
+Benchmarks of the coupled leaf model and the data prep.
+
+Each solver (main, main_fast, main_batch, main_secant) and calc_leaf_temp is
+timed on synthetic forcing for cool, typical and extreme heatwave regimes,
+reporting time per solve, rows/sec, the iterations to convergence and
+the number of rows that failed to converge (counted with a SolverLog for
+main_secant, which returns its best estimate rather than raising, and for
+main_batch, where one such row would otherwise fail the whole batch). The
+data prep stages are timed on the flux file if it is there. Results are written to
+benchmarks/ as JSON and compared against the previous run, flagging
+anything that got slower than the threshold.
+
+    python src/benchmark_coupled_model.py
+
+overhead() is the original micro-benchmark of the per-call overhead of
+main, rebuilding the FarquharC3/PenmanMonteith objects on every call (the
+old behaviour) against reusing the solvers cached on the instance.
+"""
+
+import os
+import sys
+import glob
+import json
+import time
+import timeit
+import platform
+import subprocess
+import numpy as np
+
+sys.path.append('Coupled_Canopy')
+from backup_how_i_did_topt import CoupledModel, ConvergenceError
+from solver_log import SolverLog, CONVERGED, FAILED
+import constants as c
+import wtc_data
+from wtc_data import read_file, get_chamber_means, get_model_data, get_fname
+from wtc_data import MODEL_COLUMNS
+
+__author__  = "Martin De Kauwe"
+__version__ = "1.0 (18.10.2026)"
+__email__   = "mdekauwe@gmail.com"
+
+# Forcing ranges: Tair (deg C), PAR (umol m-2 s-1), VPD (kPa)
+REGIMES = {
+    "cool": ((15.0, 25.0), (800.0, 1500.0), (0.5, 1.5)),
+    "typical": ((25.0, 35.0), (1000.0, 2000.0), (1.0, 3.0)),
+    "extreme": ((38.0, 48.0), (1500.0, 2200.0), (3.5, 7.0)),
+}
+
+# Fixed forcing, as in plot_modelling.py
+WIND = 8.0
+PRESSURE = 101.0 * c.KPA_2_PA
+CA = 400.
+
+def main(nrows=500, repeat=3, odir="benchmarks", fname=None, threshold=1.2):
+    """
+    Parameters:
+    ----------
+    nrows : int
+        rows of synthetic forcing per regime
+    repeat : int
+        best of this many runs of each stage
+    odir : string
+        where results are stored
+    fname : string
+        flux file for the data prep stages, None for the default (skipped
+        if it isn't there)
+    threshold : float
+        flag stages this many times slower than the previous run
+
+    Returns:
+    --------
+    results : dict
+        run metadata & {stage: {regime: stats}}
+    """
+    C = build_model()
+    stages = {}
+    for regime in REGIMES:
+        (tair, par, vpd) = make_forcing(regime, nrows)
+        for stage, stats in bench_model(C, tair, par, vpd, repeat).items():
+            stages.setdefault(stage, {})[regime] = stats
+
+    fname = get_fname() if fname is None else fname
+    if os.path.exists(fname):
+        for stage, stats in bench_data(fname, repeat).items():
+            stages[stage] = {"data": stats}
+
+    results = {"time": time.strftime("%Y-%m-%dT%H:%M:%S"),
+               "commit": git_commit(), "python": platform.python_version(),
+               "machine": platform.node(), "nrows": nrows, "stages": stages}
+
+    report(results)
+    previous = load_previous(odir)
+    if previous is not None:
+        for (stage, regime, ratio) in compare(previous, results, threshold):
+            print("SLOWER: %s (%s) %.2fx vs %s" % (stage, regime, ratio,
+                                                   previous["commit"]))
+    save(results, odir)
+
+    return results
+
+def make_forcing(regime, n, seed=0):
+    """ n rows of random forcing within a regime """
+    rng = np.random.RandomState(seed)
+    return tuple(rng.uniform(lo, hi, n) for (lo, hi) in REGIMES[regime])
+
+def bench_model(C, tair, par, vpd, repeat=3):
+    """ Time each solver over the rows """
+    n = len(tair)
+    rows = list(zip(tair, par, vpd))
+
+    # rows that didn't converge in the last run of each stage
+    failed = {}
+
+    def per_row(stage, func):
+        def run():
+            failed[stage] = 0
+            for (t, p, v) in rows:
+                try:
+                    func(t, p, v, WIND, PRESSURE, CA)
+                except ConvergenceError:
+                    failed[stage] += 1
+        return run
+
+    (F, P, photo_params) = C.get_solvers()
+    (An, gsc) = F.calc_photosynthesis(Cs=CA, Tleaf=30.0 + c.DEG_2_KELVIN,
+                                      Par=1500.0, vpd=2.0, **photo_params)
+
+    def batch():
+        # rows that didn't converge are counted by count_logged
+        try:
+            C.main_batch(tair, par, vpd, WIND, PRESSURE, CA)
+        except ConvergenceError:
+            pass
+
+    def leaf_temp():
+        for (t, p, v) in rows:
+            C.calc_leaf_temp(P, t, t, gsc, p, v, PRESSURE, WIND)
+
+    stages = {
+        "main": per_row("main", C.main),
+        "main_fast": per_row("main_fast", C.main_fast),
+        "main_secant": per_row("main_secant", C.main_secant),
+        "main_batch": batch,
+        "calc_leaf_temp": leaf_temp,
+    }
+
+    results = {}
+    for stage, func in stages.items():
+        try:
+            best = min(timeit.repeat(func, number=1, repeat=repeat))
+        except Exception as e:
+            print("%s failed: %s" % (stage, e))
+            continue
+        results[stage] = {"seconds": best, "us_per_solve": best / n * 1E6,
+                          "rows_per_sec": n / best}
+        if stage in failed:
+            results[stage]["failed"] = failed[stage]
+
+    if "main" in results:
+        results["main"].update(count_iterations(C, tair, par, vpd))
+    for stage in ("main_secant", "main_batch"):
+        if stage in results:
+            results[stage].update(count_logged(C, stages[stage]))
+
+    return results
+
+def count_iterations(C, tair, par, vpd):
+    """ Fixed-point iterations to convergence of each row, from cold """
+    solvers = C.get_solvers()
+    iters = []
+    failed = 0
+    for (t, p, v) in zip(tair, par, vpd):
+        try:
+            out = C.iterate(solvers, t, p, v, WIND, PRESSURE, CA, t, CA, v)
+            iters.append(out[7])
+        except ConvergenceError:
+            failed += 1
+    iters = np.array(iters) if iters else np.array([np.nan])
+
+    return {"iter_mean": float(np.mean(iters)),
+            "iter_max": float(np.max(iters)),
+            "failed": failed}
+
+def count_logged(C, run):
+    """
+    Iterations to convergence & rows that failed, from a SolverLog attached
+    to C for a run of the solver (outside the timings)
+    """
+    (saved, C._log) = (C._log, SolverLog())
+    try:
+        run()
+        log = C._log.to_array()
+    finally:
+        C._log = saved
+
+    iters = log["iters"][log["status"] == CONVERGED]
+    iters = iters if len(iters) else np.array([np.nan])
+
+    return {"iter_mean": float(np.mean(iters)),
+            "iter_max": float(np.max(iters)),
+            "failed": int(np.count_nonzero(log["status"] == FAILED))}
+
+def bench_data(fname, repeat=3):
+    """ Time the data prep stages on the flux file """
+    wtc = read_file(fname, MODEL_COLUMNS)
+    n = len(wtc)
+
+    def model_data():
+        # from scratch, not the index kept for the session
+        wtc_data._INDEXES.clear()
+        get_model_data(fname)
+
+    stages = {
+        "read_file": lambda: read_file(fname, MODEL_COLUMNS),
+        "get_chamber_means": lambda: get_chamber_means(wtc, "30min"),
+        "get_model_data": model_data,
+    }
+
+    results = {}
+    for stage, func in stages.items():
+        best = min(timeit.repeat(func, number=1, repeat=repeat))
+        results[stage] = {"seconds": best, "rows_per_sec": n / best}
+
+    return results
+
+def report(results):
+    print("%-18s %-8s %12s %12s %10s %8s" % ("stage", "regime", "us/solve",
+                                              "rows/sec", "iter mean",
+                                              "failed"))
+    for stage, regimes in results["stages"].items():
+        for regime, stats in regimes.items():
+            us = stats.get("us_per_solve")
+            iters = stats.get("iter_mean")
+            print("%-18s %-8s %12s %12.0f %10s %8s" %
+                  (stage, regime, "-" if us is None else "%.1f" % (us),
+                   stats["rows_per_sec"],
+                   "-" if iters is None else "%.1f" % (iters),
+                   stats.get("failed", "-")))
+
+def compare(previous, results, threshold=1.2):
+    """
+    (stage, regime, ratio) of everything slower per row than threshold x,
+    so runs with different nrows are comparable
+    """
+    slower = []
+    for stage, regimes in results["stages"].items():
+        for regime, stats in regimes.items():
+            try:
+                old = previous["stages"][stage][regime]["rows_per_sec"]
+            except KeyError:
+                continue
+            ratio = old / stats["rows_per_sec"]
+            if ratio > threshold:
+                slower.append((stage, regime, ratio))
+
+    return slower
+
+def save(results, odir):
+    if not os.path.exists(odir):
+        os.makedirs(odir)
+    ofname = os.path.join(odir, "%s_%s.json" %
+                          (results["time"].replace(":", ""),
+                           results["commit"]))
+    with open(ofname, "w") as f:
+        json.dump(results, f, indent=1)
+
+    return ofname
+
+def load_previous(odir):
+    fnames = sorted(glob.glob(os.path.join(odir, "*.json")))
+    if not fnames:
+        return None
+    with open(fnames[-1]) as f:
+        return json.load(f)
+
+def git_commit():
+    try:
+        out = subprocess.check_output(["git", "rev-parse", "--short", "HEAD"],
+                                      stderr=subprocess.DEVNULL)
+        return out.decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+def overhead(ncalls=20000, repeat=5):
+
+    C = build_model()
+
+    # typical heatwave afternoon
+    forcing = (40.0, 1800.0, 4.0, 8.0, 101.0 * c.KPA_2_PA, 400.)
+
+    def rebuilt():
+        C._solvers = None
+        C.get_solvers()
+
+    def cached():
+        C.get_solvers()
+
+    def main_rebuilt():
+        C._solvers = None
+        C.main(*forcing)
+
+    def main_cached():
+        C.main(*forcing)
+
+    print("%-24s %12s" % ("", "us per call"))
+    for label, func in [("get_solvers (rebuilt)", rebuilt),
+                        ("get_solvers (cached)", cached),
+                        ("main (rebuilt)", main_rebuilt),
+                        ("main (cached)", main_cached)]:
+        best = min(timeit.repeat(func, number=ncalls, repeat=repeat))
+        print("%-24s %12.2f" % (label, best / ncalls * 1E6))
+
+def build_model():
+
+    # Same parameters as plot_modelling.py
+    Vcmax25 = 34.0
+    Jmax25 = 60.0
+    Rd25 = 0.92
+    Eaj = 21640.
+    Eav = 51780.
+    deltaSj = 633.0
+    deltaSv = 640.0
+    Hdv = 200000.0
+    Hdj = 200000.0
+    Q10 = 1.92
+    leaf_width = 0.01
+    SW_abs = 0.86
+    g0 = 0.003
+    g1 = 2.9
+    D0 = 1.5
+    gamma = 0.0
+
+    return CoupledModel(g0, g1, D0, gamma, Vcmax25, Jmax25, Rd25,
+                        Eaj, Eav, deltaSj, deltaSv, Hdv, Hdj, Q10, leaf_width,
+                        SW_abs, gs_model="medlyn")
+
+
+if __name__== "__main__":
+
+    main()
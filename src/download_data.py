@@ -2,33 +2,314 @@
 
 """
 Download all of the data from the library at Western Sydney University...
+
+The zip is streamed to disk (resuming a partial download if there is one,
+optionally as several ranged requests in parallel) and the files in it are
+checked against the package's BagIt manifests. The manifests are kept in
+raw_data, so if the files we want there are already valid there is nothing
+to do.
+
+We only need the canopy temperature flux CSV, so members can be used to
+extract just that, or nothing at all and have wtc_data read the CSV out of
+the zip, e.g.
+
+    main(members=["*CANOPYTEMP*"])
+    main(members=[])
 """
 
 import os
 import io
+import re
+import glob
+import shutil
+import fnmatch
+import hashlib
 import zipfile
 import requests
+from concurrent.futures import ThreadPoolExecutor
 
 __author__  = "Martin De Kauwe"
 __version__ = "1.0 (19.03.2018)"
 __email__   = "mdekauwe@gmail.com"
 
-def main():
+URL = ("http://hie-pub.westernsydney.edu.au/"
+       "07fcd9ac-e132-11e7-b842-525400daae48/"
+       "WTC_TEMP-PARRA_HEATWAVE-FLUX-PACKAGE_L1.zip")
+
+MANIFESTS = {"manifest-md5.txt": "md5", "manifest-sha1.txt": "sha1"}
+CHUNK_SIZE = 1024 * 1024
+
+def main(url=URL, odir="raw_data", nparts=1, members=None):
+    """
+    Parameters:
+    ----------
+    url : string
+        data package to fetch
+    odir : string
+        where to extract the data to
+    nparts : int
+        number of parallel ranged requests to download with
+    members : list
+        filename patterns of the data files to extract, None for all of
+        them. If empty, nothing is extracted and the zip is kept instead.
+    """
+    if members != [] and is_valid(odir, members):
+        print("%s is already up to date" % (odir))
+        return
+
+    zip_fname = os.path.basename(url)
+    download(url, zip_fname, nparts)
+
+    # check everything we need against the manifests before using it
+    z = None
+    try:
+        z = zipfile.ZipFile(zip_fname)
+        names = [v for v in z.namelist()
+                 if v.startswith("data/") and not v.endswith("/")]
+        if members:
+            names = [v for v in names if is_member(v, members)]
+        # otherwise everything, including when the zip itself is kept, as
+        # then any of it might be read
+        manifests = check_zip(z, names)
+    except (IOError, zipfile.BadZipFile):
+        # a bad zip would otherwise be reused, and fail, on every run
+        if z is not None:
+            z.close()
+        for f in [zip_fname] + glob.glob(glob.escape(zip_fname) + ".part*"):
+            os.remove(f)
+        raise
+
+    if members == []:
+        z.close()
+        return
+
+    # extract the data/ files to odir, replacing just those files (odir may
+    # have other data & caches in it), with the full manifests so we can
+    # check raw_data has whichever members are asked for next time
+    for name in names:
+        ofname = os.path.join(odir, name[len("data/"):])
+        if not os.path.exists(os.path.dirname(ofname)):
+            os.makedirs(os.path.dirname(ofname))
+        with z.open(name) as f, open(ofname + ".tmp", "wb") as of:
+            shutil.copyfileobj(f, of, CHUNK_SIZE)
+        os.replace(ofname + ".tmp", ofname)
+    if not os.path.exists(odir):
+        os.makedirs(odir)
+    for manifest, entries in manifests.items():
+        with open(os.path.join(odir, manifest), "w") as f:
+            for (checksum, path) in entries:
+                f.write("%s  %s\n" % (checksum, path))
+
+    z.close()
+    os.remove(zip_fname)
+
+def download(url, fname, nparts=1, chunk_size=CHUNK_SIZE):
+    """
+    Stream url to fname. Bytes already fetched by an interrupted run (kept
+    in fname.part*) are resumed with HTTP range requests, and if nparts > 1
+    and the server supports ranges, the file is fetched as nparts ranges in
+    parallel.
+    """
+    if os.path.exists(fname):
+        return
+
+    r = requests.head(url, allow_redirects=True, timeout=60)
+    r.raise_for_status()
+    size = int(r.headers.get("Content-Length", 0))
+    ranges = r.headers.get("Accept-Ranges", "none").lower() == "bytes"
+
+    if nparts > 1 and ranges and size > 0:
+        step = -(-size // nparts)
+        parts = [("%s.part%d" % (fname, i), start,
+                  min(start + step, size) - 1)
+                 for i, start in enumerate(range(0, size, step))]
+        with ThreadPoolExecutor(max_workers=len(parts)) as executor:
+            futures = [executor.submit(fetch, url, part, start, end,
+                                       chunk_size)
+                       for (part, start, end) in parts]
+            for future in futures:
+                future.result()
+    else:
+        parts = [(fname + ".part0", 0, size - 1 if size > 0 else None)]
+        fetch(url, parts[0][0], end=parts[0][2], chunk_size=chunk_size)
+
+    with open(fname + ".tmp", "wb") as f:
+        for (part, start, end) in parts:
+            with open(part, "rb") as fp:
+                shutil.copyfileobj(fp, f, chunk_size)
+
+    if size > 0 and os.path.getsize(fname + ".tmp") != size:
+        # don't resume from these next time
+        os.remove(fname + ".tmp")
+        for (part, start, end) in parts:
+            os.remove(part)
+        raise IOError("Download of %s is incomplete" % (url))
+
+    os.rename(fname + ".tmp", fname)
+    # including any left by a run with a different number of parts
+    for part in glob.glob(glob.escape(fname) + ".part*"):
+        os.remove(part)
+
+def fetch(url, fname, start=0, end=None, chunk_size=CHUNK_SIZE):
+    """
+    Stream bytes start to end (inclusive, None for the end of the file) of
+    url into fname, carrying on from whatever is already in fname. If that
+    doesn't line up with what the server has (it's bigger than the range,
+    or left from a different version of the file) it is thrown away and
+    the range fetched again.
+    """
+    size = None if end is None else end - start + 1
+    have = os.path.getsize(fname) if os.path.exists(fname) else 0
+    if size is not None and have > size:
+        return refetch(url, fname, start, end, chunk_size)
+    if size is not None and have == size:
+        return
+
+    headers = {}
+    if start + have > 0 or end is not None:
+        headers["Range"] = "bytes=%d-%s" % (start + have,
+                                            "" if end is None else end)
+
+    with requests.get(url, headers=headers, stream=True, timeout=60) as r:
+        if r.status_code == 416:
+            # nothing left to fetch, if what we have is the whole file
+            (first, last, total) = content_range(r)
+            if end is None and have > 0 and start + have == total:
+                return
+            if have == 0:
+                raise IOError("%s can't send bytes %d-%s" %
+                              (url, start, "" if end is None else end))
+            return refetch(url, fname, start, end, chunk_size)
+        r.raise_for_status()
+
+        if r.status_code == 206:
+            (first, last, total) = content_range(r)
+            if first != start + have or (end is not None and last != end):
+                if have == 0:
+                    raise IOError("%s sent bytes %s-%s, not %d-%s" %
+                                  (url, first, last, start,
+                                   "" if end is None else end))
+                return refetch(url, fname, start, end, chunk_size)
+            length = last - first + 1
+            mode = "ab"
+        elif start > 0:
+            raise IOError("%s doesn't support range requests" % (url))
+        else:
+            # whole file, start again
+            length = size
+            mode = "wb"
+
+        if (length is not None and "Content-Length" in r.headers and
+            int(r.headers["Content-Length"]) != length):
+            raise IOError("%s is sending %s bytes, not %d" %
+                          (url, r.headers["Content-Length"], length))
+
+        with open(fname, mode) as f:
+            for block in r.iter_content(chunk_size):
+                f.write(block)
+
+def refetch(url, fname, start=0, end=None, chunk_size=CHUNK_SIZE):
+    """ Throw away fname and fetch its range again from scratch """
+    os.remove(fname)
+    fetch(url, fname, start, end, chunk_size)
+
+def content_range(r):
+    """ (first, last, total) bytes of a response's Content-Range, or None """
+    match = re.match(r"bytes\s+(?:(\d+)-(\d+)|\*)/(\d+|\*)",
+                     r.headers.get("Content-Range", ""))
+    if match is None:
+        return (None, None, None)
+
+    return tuple(None if v is None or v == "*" else int(v)
+                 for v in match.groups())
+
+def check_zip(z, names):
+    """
+    Check the names files in the open zip z against its manifests, raising
+    an IOError on the first one that doesn't match.
+
+    Returns:
+    --------
+    manifests : dict
+        {manifest: [(checksum, path), ...]} of every manifest in the zip
+    """
+    manifests = {}
+    for manifest in MANIFESTS:
+        if manifest in z.namelist():
+            manifests[manifest] = read_manifest(io.TextIOWrapper(\
+                                                    z.open(manifest)))
+            for (checksum, path) in manifests[manifest]:
+                if path not in names:
+                    continue
+                with z.open(path) as f:
+                    if file_hash(f, MANIFESTS[manifest]) != checksum:
+                        raise IOError("%s doesn't match %s" % (path,
+                                                               manifest))
+
+    return manifests
+
+def check_manifest(manifest, root, prefix="", members=None):
+    """
+    Check files against a BagIt manifest ("checksum  data/path" per line),
+    raising an IOError on the first one that is missing or doesn't match.
+    Paths are relative to root, with prefix swapped for root if given. If
+    members are given, only the files matching them are checked.
+    """
+    algo = MANIFESTS[os.path.basename(manifest)]
+    with open(manifest) as f:
+        entries = read_manifest(f)
+
+    for (checksum, path) in entries:
+        if members is not None and not is_member(path, members):
+            continue
+        if prefix and path.startswith(prefix):
+            path = path[len(prefix):]
+        path = os.path.join(root, path)
+        if not os.path.exists(path):
+            raise IOError("%s is missing" % (path))
+        with open(path, "rb") as f:
+            if file_hash(f, algo) != checksum:
+                raise IOError("%s doesn't match %s" % (path, manifest))
+
+def read_manifest(f):
+    """ (checksum, path) for each line of a BagIt manifest """
+    entries = []
+    for line in f:
+        if line.strip():
+            (checksum, path) = line.strip().split(None, 1)
+            entries.append((checksum.lower(), path))
+
+    return entries
+
+def file_hash(f, algo, chunk_size=CHUNK_SIZE):
+    h = hashlib.new(algo)
+    for block in iter(lambda: f.read(chunk_size), b""):
+        h.update(block)
+
+    return h.hexdigest()
+
+def is_member(path, members):
+    """ Does the file name of path match any of the members patterns? """
+    return any(fnmatch.fnmatch(os.path.basename(path), pattern)
+               for pattern in members)
 
-    url = ("http://hie-pub.westernsydney.edu.au/"
-           "07fcd9ac-e132-11e7-b842-525400daae48/"
-           "WTC_TEMP-PARRA_HEATWAVE-FLUX-PACKAGE_L1.zip")
+def is_valid(odir, members=None):
+    """
+    Does odir have an unmodified copy of the data package files matching
+    members (all of them if None)?
+    """
+    manifests = [os.path.join(odir, m) for m in MANIFESTS
+                 if os.path.exists(os.path.join(odir, m))]
+    if not manifests:
+        return False
 
-    r = requests.get(url)
-    z = zipfile.ZipFile(io.BytesIO(r.content))
-    z.extractall()
+    try:
+        for manifest in manifests:
+            check_manifest(manifest, odir, prefix="data/", members=members)
+    except IOError:
+        return False
 
-    # clean up
-    os.remove("bag-info.txt")
-    os.remove("bagit.txt")
-    os.remove("manifest-md5.txt")
-    os.remove("manifest-sha1.txt")
-    os.rename("data", "raw_data")
+    return True
 
 if __name__== "__main__":
 
@@ -0,0 +1,232 @@
+#!/usr/bin/env python
+
+"""
+Lookup-table emulator of the coupled An/gs/Tleaf/E model, for when we need
+the model millions of times (sweeps, Monte-Carlo) over a bounded forcing
+space.
+
+The exact solver is run once over a regular Tair x PAR x VPD grid (for a
+given parameter set and fixed wind, pressure and Ca) and results are
+interpolated multilinearly. On building, the table is checked against the
+exact solver at random points inside the grid and the max/RMS absolute
+errors are kept with it (see Emulator.errors). If the max error of an
+output is more than atol + rtol x its largest magnitude, the emulator
+raises a ValueError, or with fallback=True just runs the exact solver.
+Multilinear interpolation error scales with the grid spacing squared, so
+if the errors are too big, use finer axes.
+
+Grid points where the solver didn't converge (main_secant returns its best
+estimate) are flagged in Emulator.converged, and anything interpolated from
+them is NaN (or, with fallback=True, solved exactly).
+
+Tables are saved to disk keyed on the parameters, forcing and axes, so they
+are only built once.
+"""
+
+import os
+import hashlib
+import warnings
+import numpy as np
+from scipy.interpolate import RegularGridInterpolator
+
+from model_cache import model_key
+from solver_log import SolverLog, CONVERGED
+
+__author__  = "Martin De Kauwe"
+__version__ = "1.0 (18.10.2026)"
+__email__   = "mdekauwe@gmail.com"
+
+# Default axes, covering the heatwave forcing space
+TAIR = np.arange(15.0, 50.0 + 0.5, 0.5)   # deg C
+PAR = np.arange(0.0, 2500.0 + 50.0, 50.0)  # umol m-2 s-1
+# kPa, finer at low VPD where gs (g1 / sqrt(D)) changes fastest
+VPD = np.concatenate([np.arange(0.0, 0.5, 0.05),
+                      np.arange(0.5, 8.0 + 0.2, 0.2)])
+
+OUTPUTS = ["An", "gsw", "et", "LE"]
+
+class Emulator(object):
+    """Multilinear lookup table of CoupledModel outputs."""
+
+    def __init__(self, model, wind, pressure, Ca, Topt_hack=False,
+                 tair=TAIR, par=PAR, vpd=VPD, fdir="emulators",
+                 nvalidate=2000, rtol=0.1, atol=0.0, fallback=False):
+
+        self.axes = (np.asarray(tair, dtype=np.float64),
+                     np.asarray(par, dtype=np.float64),
+                     np.asarray(vpd, dtype=np.float64))
+        self.model = model
+        self.forcing = (wind, pressure, Ca, Topt_hack)
+        self.fname = os.path.join(fdir, "emulator_%s.npz" % (self.key()))
+
+        self.fallback = fallback
+        self.exact = False
+
+        if not (os.path.exists(self.fname) and self.load()):
+            self.build()
+            (self.errors, self.scale) = self.validate(nvalidate)
+            if not os.path.exists(fdir):
+                os.makedirs(fdir)
+            self.save()
+
+        # outside the table we return NaN rather than extrapolate
+        self.interp = RegularGridInterpolator(self.axes,
+                                              np.moveaxis(self.table, 0, -1),
+                                              method="linear",
+                                              bounds_error=False,
+                                              fill_value=np.nan)
+        # 1 where every grid point used converged
+        self.interp_converged = RegularGridInterpolator(\
+                                    self.axes, self.converged.astype(float),
+                                    method="linear", bounds_error=False,
+                                    fill_value=np.nan)
+
+        over = [v for v in OUTPUTS
+                if not self.errors[v][0] <= atol + rtol * self.scale[v]]
+        if over:
+            msg = ("Emulator error of %s is over the tolerance, use finer "
+                   "axes" % (", ".join("%s (%g)" % (v, self.errors[v][0])
+                                       for v in over)))
+            if not fallback:
+                raise ValueError(msg)
+            warnings.warn(msg + ", using the exact solver")
+            self.exact = True
+
+    def main_batch(self, tair, par, vpd):
+        """
+        Emulated equivalent of CoupledModel.main_batch at the fixed wind,
+        pressure and Ca.
+
+        Parameters:
+        ----------
+        tair : array
+            air temperature (deg C)
+        par : array
+            Photosynthetically active radiation (umol m-2 s-1)
+        vpd : array
+            Vapour pressure deficit (kPa)
+
+        Returns:
+        --------
+        An, gsw, et, le_et : arrays
+            see CoupledModel.main_batch, NaN outside the table and where
+            it (or with fallback, the exact solver) didn't converge
+        """
+        pts = np.stack(np.broadcast_arrays(*[np.atleast_1d(\
+                                             np.asarray(v, dtype=np.float64))
+                                             for v in (tair, par, vpd)]),
+                       axis=-1)
+        if self.exact:
+            bad = np.ones(pts.shape[:-1], dtype=bool)
+            out = np.full(pts.shape[:-1] + (len(OUTPUTS),), np.nan)
+        else:
+            out = self.interp(pts)
+            # interpolated from a grid point that didn't converge
+            bad = self.interp_converged(pts) < 1.0 - 1E-09
+            out[bad] = np.nan
+
+        if self.fallback and np.any(bad):
+            (solved, converged) = self.solve(*pts[bad].T)
+            solved[:,~converged] = np.nan
+            out[bad] = solved.T
+
+        return tuple(np.moveaxis(out, -1, 0))
+
+    def build(self):
+        (tair, par, vpd) = [v.ravel() for v in np.meshgrid(*self.axes,
+                                                           indexing="ij")]
+        (out, converged) = self.solve(tair, par, vpd)
+        shape = tuple(len(v) for v in self.axes)
+        self.table = out.reshape((len(OUTPUTS),) + shape)
+        self.converged = converged.reshape(shape)
+
+    def solve(self, tair, par, vpd):
+        """
+        Exact solver, safe against the odd point not converging
+
+        Returns:
+        --------
+        out : array
+            (len(OUTPUTS), npoints) results, main_secant's best estimate
+            where it didn't converge
+        converged : array
+            whether each point converged
+        """
+        (wind, pressure, Ca, Topt_hack) = self.forcing
+        out = np.full((len(OUTPUTS), len(tair)), np.nan)
+
+        # borrow the model's log slot to see which points converged
+        log = SolverLog(len(tair))
+        (saved, self.model._log) = (self.model._log, log)
+        try:
+            for i in range(len(tair)):
+                out[:,i] = self.model.main_secant(tair[i], par[i], vpd[i],
+                                                  wind, pressure, Ca,
+                                                  Topt_hack=Topt_hack)
+        finally:
+            self.model._log = saved
+
+        return (out, log.to_array()["status"] == CONVERGED)
+
+    def validate(self, n, seed=0):
+        """
+        Max & RMS absolute error of the table against the exact solver at n
+        random points within the grid, leaving out points that (or whose
+        grid neighbours) didn't converge.
+
+        Returns:
+        --------
+        errors : dict
+            {output: (max abs error, rms error)}
+        scale : dict
+            {output: largest magnitude of the exact values}
+        """
+        rng = np.random.RandomState(seed)
+        (tair, par, vpd) = [rng.uniform(v[0], v[-1], n) for v in self.axes]
+        pts = np.stack([tair, par, vpd], axis=-1)
+        interp = RegularGridInterpolator(self.axes,
+                                         np.moveaxis(self.table, 0, -1))
+        approx = np.moveaxis(interp(pts), -1, 0)
+        (exact, converged) = self.solve(tair, par, vpd)
+        interp = RegularGridInterpolator(self.axes,
+                                         self.converged.astype(float))
+        ok = converged & (interp(pts) >= 1.0 - 1E-09)
+        diff = approx[:,ok] - exact[:,ok]
+
+        errors = {v: (np.nanmax(np.abs(d)), np.sqrt(np.nanmean(d**2)))
+                  for v, d in zip(OUTPUTS, diff)}
+        scale = {v: np.nanmax(np.abs(e)) for v, e in zip(OUTPUTS,
+                                                          exact[:,ok])}
+
+        return (errors, scale)
+
+    def key(self):
+        """ Hash of everything the table depends on """
+        h = hashlib.md5()
+        h.update(repr((model_key(self.model), self.forcing)).encode())
+        for v in self.axes:
+            h.update(v.tobytes())
+
+        return h.hexdigest()[:16]
+
+    def save(self):
+        errors = np.array([self.errors[v] for v in OUTPUTS])
+        scale = np.array([self.scale[v] for v in OUTPUTS])
+        np.savez(self.fname, table=self.table, tair=self.axes[0],
+                 par=self.axes[1], vpd=self.axes[2], errors=errors,
+                 scale=scale, converged=self.converged)
+
+    def load(self):
+        """
+        Read the saved table, False if it needs building again as it is
+        from before the convergence flags were kept
+        """
+        f = np.load(self.fname)
+        if "converged" not in f.files:
+            return False
+        self.table = f["table"]
+        self.converged = f["converged"]
+        self.errors = {v: tuple(e) for v, e in zip(OUTPUTS, f["errors"])}
+        self.scale = dict(zip(OUTPUTS, f["scale"]))
+
+        return True
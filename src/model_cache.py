@@ -0,0 +1,183 @@
+#!/usr/bin/env python
+
+"""
+Memoise CoupledModel results, so the same forcing (e.g. the baseline run that
+every sensitivity figure repeats) isn't solved again and again.
+
+Forcing is quantised before lookup and the model is run at the quantised
+values, so a cached result doesn't depend on which row first filled it. The
+key also includes the model parameters, so one cache can hold any number of
+scenarios and be saved to disk between runs.
+"""
+
+import os
+import sys
+import pickle
+import numpy as np
+from functools import partial
+from collections import OrderedDict
+
+__author__  = "Martin De Kauwe"
+__version__ = "1.0 (18.10.2026)"
+__email__   = "mdekauwe@gmail.com"
+
+# Step each input is rounded to before lookup
+RESOLUTION = {
+    "tair": 0.01,     # deg C
+    "par": 1.0,       # umol m-2 s-1
+    "vpd": 0.001,     # kPa
+    "wind": 0.01,     # m s-1
+    "pressure": 1.0,  # Pa
+    "Ca": 0.1,        # umol mol-1
+}
+
+FORCING = ["tair", "par", "vpd", "wind", "pressure", "Ca"]
+
+class ResultCache(object):
+    """Bounded LRU store of (An, gsw, et, le_et) from CoupledModel."""
+
+    def __init__(self, resolution=RESOLUTION, maxsize=1000000, fname=None):
+
+        self.resolution = dict(resolution)
+        self.maxsize = maxsize
+        self.fname = fname
+        self.hits = 0
+        self.misses = 0
+        self.store = OrderedDict()
+
+        if fname is not None and os.path.exists(fname):
+            self.load(fname)
+
+    def main(self, model, tair, par, vpd, wind, pressure, Ca, Topt_hack=False):
+        """ Cached equivalent of model.main for a single timestep """
+        (An, gsw, et, le_et) = self.main_batch(model, tair, par, vpd, wind,
+                                               pressure, Ca, Topt_hack)
+
+        return (An[0], gsw[0], et[0], le_et[0])
+
+    def main_batch(self, model, tair, par, vpd, wind, pressure, Ca,
+                   Topt_hack=False):
+        """
+        Cached equivalent of model.main_batch, only the rows we haven't seen
+        before are solved.
+
+        Returns:
+        --------
+        An, gsw, et, le_et : arrays
+            see CoupledModel.main_batch
+        """
+        forcing = np.broadcast_arrays(*[np.atleast_1d(\
+                                        np.asarray(v, dtype=np.float64))
+                                        for v in (tair, par, vpd, wind,
+                                                  pressure, Ca)])
+        forcing = np.vstack([self.quantise(v, k)
+                             for k, v in zip(FORCING, forcing)])
+        n = forcing.shape[1]
+        prefix = (model_key(model), bool(Topt_hack))
+        keys = [prefix + tuple(col) for col in forcing.T.tolist()]
+
+        out = np.full((4, n), np.nan)
+        todo = OrderedDict()
+        for i, key in enumerate(keys):
+            if key in self.store:
+                self.store.move_to_end(key)
+                out[:,i] = self.store[key]
+                self.hits += 1
+            else:
+                todo.setdefault(key, []).append(i)
+                self.misses += 1
+
+        if todo:
+            cols = [todo_rows[0] for todo_rows in todo.values()]
+            new = np.array(model.main_batch(*forcing[:,cols],
+                                            Topt_hack=Topt_hack))
+            for j, (key, rows) in enumerate(todo.items()):
+                out[:,rows] = new[:,j:j+1]
+                self.put(key, tuple(new[:,j]))
+
+        return tuple(out)
+
+    def quantise(self, values, name):
+        step = self.resolution.get(name)
+        if not step:
+            return values
+
+        return np.round(values / step) * step
+
+    def put(self, key, value):
+        self.store[key] = value
+        self.store.move_to_end(key)
+        while len(self.store) > self.maxsize:
+            self.store.popitem(last=False)
+
+    def clear(self):
+        self.store.clear()
+        self.hits = 0
+        self.misses = 0
+
+    def save(self, fname=None):
+        """ Pickle the cache, to fname or the file it was created with """
+        fname = self.fname if fname is None else fname
+        with open(fname, "wb") as f:
+            pickle.dump({"resolution": self.resolution,
+                         "store": self.store}, f,
+                        protocol=pickle.HIGHEST_PROTOCOL)
+
+    def load(self, fname):
+        with open(fname, "rb") as f:
+            saved = pickle.load(f)
+
+        # entries quantised differently aren't comparable
+        if saved["resolution"] == self.resolution:
+            for key, value in saved["store"].items():
+                self.put(key, value)
+
+    def __len__(self):
+        return len(self.store)
+
+    def __repr__(self):
+        return ("ResultCache(size=%d, hits=%d, misses=%d)" %
+                (len(self), self.hits, self.misses))
+
+def model_key(model):
+    """
+    Implementation (class & its module's version) and parameters of a
+    CoupledModel as a hashable tuple that is the same from one session to
+    the next, see stable_key
+    """
+    params = [(k, v) for k, v in vars(model).items() if not k.startswith("_")]
+    per_row = [k for (k, v) in params if np.ndim(v) > 0]
+    if per_row:
+        raise ValueError("Can't cache a model with per-row parameters: %s" %
+                         (", ".join(sorted(per_row))))
+
+    cls = type(model)
+    version = getattr(sys.modules.get(cls.__module__), "__version__", None)
+
+    return ((("__class__", "%s.%s" % (cls.__module__, cls.__qualname__)),
+             ("__version__", version)) +
+            tuple(sorted((k, stable_key(v, k)) for (k, v) in params)))
+
+def stable_key(value, name="value"):
+    """
+    A parameter value as something hashable, with functions (e.g. g0_func)
+    keyed on where they are defined, and partials on their function and
+    arguments, rather than on their identity. Lambdas & functions defined
+    inside others can't be found again by name, so raise a ValueError.
+    """
+    if isinstance(value, partial):
+        return ("partial", stable_key(value.func, name),
+                tuple(stable_key(v, name) for v in value.args),
+                tuple(sorted((k, stable_key(v, name))
+                             for k, v in value.keywords.items())))
+    elif callable(value):
+        qualname = getattr(value, "__qualname__", None)
+        if qualname is None or "<" in qualname:
+            raise ValueError("Can't cache a model with %s = %r, use a "
+                             "module level function (or a partial of one)" %
+                             (name, value))
+        return "%s.%s" % (value.__module__, qualname)
+    elif isinstance(value, np.generic):
+        return value.item()
+
+    return value
@@ -10,39 +10,23 @@ import matplotlib.pyplot as plt
 import pandas as pd
 import datetime as dt
 import numpy as np
-from scipy.stats import gaussian_kde
 
 sys.path.append('Coupled_Canopy')
 from farq import FarquharC3
 from solve_coupled_An_gs_leaf_temp_transpiration import CoupledModel
 from utils import vpd_to_rh, get_dewpoint, calc_esat
 import constants as c
+from plot_utils import calc_density, scatter, legend_handles
+from profiler import stage
+from wtc_data import get_model_data
 
 __author__  = "Martin De Kauwe"
 __version__ = "1.0 (16.04.2018)"
 __email__   = "mdekauwe@gmail.com"
 
-def main(fname):
+def main(fname, odir="plots"):
 
-    wtc = read_file(fname)
-
-    # create hourly values for subsequent averaging of fluxes
-    wtc["DateTime_hr"] = wtc["DateTime_hr"].apply(\
-                            lambda x: pd.to_datetime(x).round('30min'))
-    wtc_m = wtc.groupby(['DateTime_hr', 'chamber','T_treatment',
-                         'HWtrt','combotrt'], as_index=False).mean()
-    wtc_m = wtc_m.set_index('DateTime_hr')
-
-    st = pd.datetime.strptime('2016-10-20 00:00:00', '%Y-%m-%d %H:%M:%S')
-    en = pd.datetime.strptime('2016-11-11 20:00:00', '%Y-%m-%d %H:%M:%S')
-    wtc_m = wtc_m[(wtc_m.index >= st) & (wtc_m.index <= en)]
-
-    df_ct = wtc_m[(wtc_m["HWtrt"] == "C") & (wtc_m["PAR"] > 10.0)]
-    df_hw = wtc_m[(wtc_m["HWtrt"] == "HW") & (wtc_m["PAR"] > 10.0)]
-
-    PARlimit = 600
-    df_ct = df_ct[df_ct["PAR"] > PARlimit]
-    df_hw = df_hw[df_hw["PAR"] > PARlimit]
+    (df_ct, df_hw) = get_model_data(fname)
 
 
     # Parameters
@@ -82,26 +66,21 @@ def main(fname):
     #print(An, gsw, et, LE)
     #sys.exit()
 
-    #"""
-    Et_ct = []
-    An_ct = []
-    Et_hw = []
-    An_hw = []
-    for i in range(len(df_ct)):
-        (An, gsw, et, LE) = C.main(df_ct.Tair_al[i], df_ct.PAR[i], df_ct.VPD[i],
-                                   wind, pressure, Ca)
-        Et_ct.append(et* c.MOL_2_MMOL) # mmol m-2 s-1
-        An_ct.append(An)               # umol m-2 s-1
-    #"""
-
-    Et_hw = []
-    An_hw = []
-    for i in range(len(df_hw)):
+    # Coupled_Canopy's model solves a row at a time
+    with stage("model"):
+        (An_ct, gsw, et, LE) = np.array([C.main(t, p, v, wind, pressure, Ca)
+                                         for (t, p, v) in zip(
+                                            df_ct.Tair_al.to_numpy(),
+                                            df_ct.PAR.to_numpy(),
+                                            df_ct.VPD.to_numpy())]).T
+        Et_ct = et * c.MOL_2_MMOL # mmol m-2 s-1
 
-        (An, gsw, et, LE) = C.main(df_hw.Tair_al[i], df_hw.PAR[i], df_hw.VPD[i],
-                                   wind, pressure, Ca)
-        Et_hw.append(et * c.MOL_2_MMOL) # mmol m-2 s-1
-        An_hw.append(An)                # umol m-2 s-1
+        (An_hw, gsw, et, LE) = np.array([C.main(t, p, v, wind, pressure, Ca)
+                                         for (t, p, v) in zip(
+                                            df_hw.Tair_al.to_numpy(),
+                                            df_hw.PAR.to_numpy(),
+                                            df_hw.VPD.to_numpy())]).T
+        Et_hw = et * c.MOL_2_MMOL # mmol m-2 s-1
 
 
     # roughly paper size
@@ -132,49 +111,45 @@ def main(fname):
 
     x = np.nan_to_num(x)
     y = np.nan_to_num(y)
-    xy = np.vstack([x, y])
-    z = gaussian_kde(xy)(xy)
-    ax1.scatter(x, y,  c=z, s=25, edgecolor='', cmap='Blues', alpha=0.7,
-                label="CT")
-    ax1.scatter(x, dummy, s=25, edgecolor='', alpha=0.7, label="HW")
-    ax1.scatter(x, An_ct, color='black', s=5, alpha=0.7, label="Model")
+    z = calc_density(x, y)
+    scatter(ax1, x, y,  c=z, s=25, edgecolor='', cmap='Blues', alpha=0.7,
+                 label="CT")
+    scatter(ax1, x, dummy, s=25, edgecolor='', alpha=0.7, label="HW")
+    scatter(ax1, x, An_ct, color='black', s=5, alpha=0.7, label="Model")
     ax1.legend(scatterpoints=1, loc="best", frameon=False, handletextpad=0.1)
 
-    legend = ax1.get_legend()
-    legend.legendHandles[0].set_color("blue")
-    legend.legendHandles[1].set_color("red")
-    legend.legendHandles[2].set_color("black")
+    handles = legend_handles(ax1.get_legend())
+    handles[0].set_color("blue")
+    handles[1].set_color("red")
+    handles[2].set_color("black")
 
-    legend.legendHandles[0]._sizes = [60]
-    legend.legendHandles[1]._sizes = [60]
-    legend.legendHandles[2]._sizes = [60]
+    handles[0]._sizes = [60]
+    handles[1]._sizes = [60]
+    handles[2]._sizes = [60]
 
     x = df_hw.TargTempC_Avg
     y = df_hw.Photo
     x = np.nan_to_num(x)
     y = np.nan_to_num(y)
-    xy = np.vstack([x, y])
-    z = gaussian_kde(xy)(xy)
-    ax2.scatter(x, y,  c=z, s=25, edgecolor='', cmap='Reds', alpha=0.7)
-    ax2.scatter(x, An_hw, color='black', s=5, alpha=0.7)
+    z = calc_density(x, y)
+    scatter(ax2, x, y,  c=z, s=25, edgecolor='', cmap='Reds', alpha=0.7)
+    scatter(ax2, x, An_hw, color='black', s=5, alpha=0.7)
 
     x = df_ct.TargTempC_Avg
     y = df_ct.Trans
     x = np.nan_to_num(x)
     y = np.nan_to_num(y)
-    xy = np.vstack([x, y])
-    z = gaussian_kde(xy)(xy)
-    ax3.scatter(x, y,  c=z, s=25, edgecolor='', cmap='Blues', alpha=0.7)
-    ax3.scatter(x, Et_ct, color='black', s=5, alpha=0.7)
+    z = calc_density(x, y)
+    scatter(ax3, x, y,  c=z, s=25, edgecolor='', cmap='Blues', alpha=0.7)
+    scatter(ax3, x, Et_ct, color='black', s=5, alpha=0.7)
 
     x = df_hw.TargTempC_Avg
     y = df_hw.Trans
     x = np.nan_to_num(x)
     y = np.nan_to_num(y)
-    xy = np.vstack([x, y])
-    z = gaussian_kde(xy)(xy)
-    ax4.scatter(x, y,  c=z, s=25, edgecolor='', cmap='Reds', alpha=0.7)
-    ax4.scatter(x, Et_hw, color='black', s=5, alpha=0.7)
+    z = calc_density(x, y)
+    scatter(ax4, x, y,  c=z, s=25, edgecolor='', cmap='Reds', alpha=0.7)
+    scatter(ax4, x, Et_hw, color='black', s=5, alpha=0.7)
 
     ax1.set_ylim(-1, 15)
     ax2.set_ylim(-1, 15)
@@ -205,28 +180,14 @@ def main(fname):
     plt.setp(ax2.get_xticklabels(), visible=False)
     plt.setp(ax2.get_yticklabels(), visible=False)
     plt.setp(ax4.get_yticklabels(), visible=False)
-    #fig.savefig("plots/exp_plus_modellng.pdf", bbox_inches='tight',
-    #            pad_inches=0.1)
-    fig.savefig("plots/exp_plus_modellng.png", dpi=300, bbox_inches='tight',
-                pad_inches=0.1)
+    with stage("savefig"):
+        fig.savefig(os.path.join(odir, "exp_plus_modellng.pdf"), dpi=300,
+                    bbox_inches='tight', pad_inches=0.1)
+        fig.savefig(os.path.join(odir, "exp_plus_modellng.png"), dpi=300,
+                    bbox_inches='tight', pad_inches=0.1)
     #plt.show()
 
 
-def read_file(fname):
-
-    df = pd.read_csv(fname)
-    df['dates'] = pd.to_datetime(df['DateTime_hr'], format='%Y-%m-%d %H:%M:%S')
-    df = df.set_index('dates')
-    df.drop("DateTime_hr", inplace=True)
-    df["year"] = df.index.year
-    df["month"] = df.index.month
-    df["day"] = df.index.day
-    df["doy"] = df.index.dayofyear
-    df["hour"] = df.index.hour
-
-    return df
-
-
 if __name__== "__main__":
 
     fdir = "raw_data"
@@ -10,59 +10,31 @@ import matplotlib.pyplot as plt
 import pandas as pd
 import datetime as dt
 
+from wtc_data import read_file, get_chamber_means, add_treatments
+from wtc_data import get_treatment_means
+from profiler import stage
+
 __author__  = "Martin De Kauwe"
 __version__ = "1.0 (19.03.2018)"
 __email__   = "mdekauwe@gmail.com"
 
-def main(fname):
+def main(fname, odir="plots"):
 
-    wtc = read_file(fname)
+    columns = ["Tair_al", "VPD"]
+    wtc = read_file(fname, ["chamber"] + columns)
 
     # create hourly values for subsequent averaging of fluxes
-    wtc["DateTime_hr"] = wtc["DateTime_hr"].apply(\
-                            lambda x: pd.to_datetime(x).round('60min'))
-    wtc_m1 = wtc.groupby(['DateTime_hr', 'chamber','T_treatment'],
-                          as_index=False).mean()
-
-    # merge in the heatwave treatment key: swapped C12 and C08
-    chambers = wtc_m1.chamber.astype('category').cat.categories.tolist()
-    link_df = pd.DataFrame({'chamber': chambers,
-                            'HWtrt': ["C","C","HW","HW","C","C","HW","C",
-                                      "HW","HW","C","HW"]})
-    wtc_m = pd.merge(wtc_m1, link_df, on="chamber")
-    wtc_m["combotrt"] = (wtc_m.T_treatment + "_" +
-                         wtc_m.HWtrt).astype('category')
+    wtc_m = get_chamber_means(wtc, "60min", ['chamber'])
+
+    # attach the treatments of each chamber (see treatments.csv)
+    wtc_m = add_treatments(wtc_m)
+
+    wtc_m = wtc_m[pd.Timestamp("2016-10-30"):pd.Timestamp("2016-11-05")]
 
     # average and SEs for each treatment.
-    wtc_m2 = wtc_m1.groupby([wtc_m.DateTime_hr,
-                            wtc_m.combotrt],
-                            as_index=False).agg(['mean', 'sem'])
-
-    wtc_m = wtc_m.set_index('DateTime_hr')
-    wtc_m2_two = wtc_m[(wtc_m.index >= "2016-10-30") &
-                       (wtc_m.index <= "2016-11-05")].copy()
-    wtc_m2_two['dates'] = wtc_m2_two.index
-    wtc_m2_two["month"] = wtc_m2_two.index.month
-
-    df_ct = wtc_m2_two[wtc_m2_two["HWtrt"] == "C"]
-    df_hw = wtc_m2_two[wtc_m2_two["HWtrt"] == "HW"]
-
-    df_ct = df_ct.groupby(['DateTime_hr']).mean().reset_index()
-    df_hw = df_hw.groupby(['DateTime_hr']).mean().reset_index()
-
-    t1 = pd.datetime.strptime(df_ct['year'][0].astype(int).astype(str)+
-                              df_ct['month'][0].astype(int).astype(str)+
-                              df_ct['day'][0].astype(int).astype(str),
-                              "%Y%m%d")
-    df_ct['dates'] = pd.date_range(t1, periods=len(df_ct), freq='60Min')
-    df_ct = df_ct.set_index('dates')
-
-    t1 = pd.datetime.strptime(df_hw['year'][0].astype(int).astype(str)+
-                              df_hw['month'][0].astype(int).astype(str)+
-                              df_hw['day'][0].astype(int).astype(str),
-                              "%Y%m%d")
-    df_hw['dates'] = pd.date_range(t1, periods=len(df_hw), freq='60Min')
-    df_hw = df_hw.set_index('dates')
+    stats = get_treatment_means(wtc_m, columns, by="HWtrt")
+    df_ct = stats.xs("C", level="HWtrt")
+    df_hw = stats.xs("HW", level="HWtrt")
 
     width  = 9.0
     height = width / 1.618
@@ -98,25 +70,11 @@ def main(fname):
     ax2.get_yaxis().set_label_coords(-0.07,0.5)
     ax1.legend(numpoints=1, loc="lower left")
     #fig.savefig("plots/tair_vpd.pdf", bbox_inches='tight', pad_inches=0.1)
-    fig.savefig("plots/tair_vpd.png", dpi=300, bbox_inches='tight',
-                pad_inches=0.1)
+    with stage("savefig"):
+        fig.savefig(os.path.join(odir, "tair_vpd.png"), dpi=300,
+                    bbox_inches='tight', pad_inches=0.1)
     #plt.show()
 
-def read_file(fname):
-
-    df = pd.read_csv(fname)
-    df['dates'] = pd.to_datetime(df['DateTime_hr'], format='%Y-%m-%d %H:%M:%S')
-    df = df.set_index('dates')
-    df.drop("DateTime_hr", inplace=True)
-    df["year"] = df.index.year
-    df["month"] = df.index.month
-    df["day"] = df.index.day
-    df["doy"] = df.index.dayofyear
-    df["hour"] = df.index.hour
-
-    return df
-
-
 if __name__== "__main__":
 
     fdir = "raw_data"
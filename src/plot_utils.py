@@ -0,0 +1,159 @@
+#!/usr/bin/env python
+
+"""
+Helpers shared by the plot scripts.
+"""
+
+import numpy as np
+from scipy.stats import gaussian_kde
+from scipy.signal import fftconvolve
+from scipy.ndimage import map_coordinates
+
+from profiler import stage
+
+__author__  = "Martin De Kauwe"
+__version__ = "1.0 (18.10.2026)"
+__email__   = "mdekauwe@gmail.com"
+
+def scatter(ax, x, y, max_points=None, rasterized=True, **kwargs):
+    """
+    ax.scatter, but the markers are rasterised (so vector output, e.g. PDF,
+    stays small & quick to write, while axes and text stay as vectors) and
+    big point clouds can be thinned first, see thin. Per point colours or
+    sizes are thinned with the points.
+
+    Parameters:
+    ----------
+    ax : Axes
+        axes to draw on
+    x : array
+        x values
+    y : array
+        y values
+    max_points : int
+        draw at most this many points, None for all of them
+    rasterized : bool
+        rasterise the markers
+    kwargs : dict
+        passed on to ax.scatter
+
+    Returns:
+    --------
+    sc : PathCollection
+        the scatter layer
+    """
+    x = np.asarray(x)
+    y = np.asarray(y)
+    n = len(x)
+    if max_points is not None and n > max_points:
+        keep = thin(x, y, max_points)
+        x = x[keep]
+        y = y[keep]
+        for k in ("c", "s"):
+            if k in kwargs and np.ndim(kwargs[k]) > 0 and \
+               len(kwargs[k]) == n:
+                kwargs[k] = np.asarray(kwargs[k])[keep]
+
+    # older matplotlib took "" for no edges
+    if kwargs.get("edgecolor") == "":
+        kwargs["edgecolor"] = "none"
+
+    return ax.scatter(x, y, rasterized=rasterized, **kwargs)
+
+def legend_handles(legend):
+    """ Handles (markers) of a legend, legendHandles before matplotlib 3.7 """
+    if hasattr(legend, "legend_handles"):
+        return legend.legend_handles
+
+    return legend.legendHandles
+
+def thin(x, y, max_points, seed=0):
+    """
+    Indices of (at most) max_points of the points, sampled with probability
+    inversely proportional to the local density, so the dense core is
+    thinned and sparse points (the tails we care about) are kept.
+
+    Returns:
+    --------
+    keep : array
+        sorted indices of the points to keep
+    """
+    x = np.asarray(x, dtype=np.float64)
+    y = np.asarray(y, dtype=np.float64)
+    ok = np.flatnonzero(np.isfinite(x) & np.isfinite(y))
+    if len(ok) <= max_points:
+        return ok
+
+    z = calc_density(x[ok], y[ok])
+    weight = 1.0 / np.maximum(z, z[z > 0].min() if (z > 0).any() else 1.0)
+    rng = np.random.RandomState(seed)
+    keep = rng.choice(ok, size=max_points, replace=False,
+                      p=weight / weight.sum())
+
+    return np.sort(keep)
+
+def calc_density(x, y, ngrid=128, max_exact=2000):
+    """
+    Gaussian KDE of the points, evaluated at each point, for colouring
+    scatter plots by density.
+
+    The exact KDE is O(N^2), so above max_exact points we bin the points
+    onto a grid, convolve the counts with the same kernel gaussian_kde
+    would use (Scott's rule bandwidth, full covariance) via an FFT and
+    interpolate back to the points.
+
+    Parameters:
+    ----------
+    x : array
+        x values
+    y : array
+        y values
+    ngrid : int
+        number of grid cells along each axis
+    max_exact : int
+        use the exact KDE for this many points or fewer
+
+    Returns:
+    --------
+    z : array
+        density at each point
+    """
+    with stage("kde"):
+        return _calc_density(x, y, ngrid, max_exact)
+
+def _calc_density(x, y, ngrid=128, max_exact=2000):
+    xy = np.vstack([np.asarray(x, dtype=np.float64),
+                    np.asarray(y, dtype=np.float64)])
+    kde = gaussian_kde(xy)
+    n = xy.shape[1]
+    if n <= max_exact:
+        return kde(xy)
+
+    cov = kde.covariance
+    bw = np.sqrt(np.diag(cov))
+
+    # pad the grid so the kernel tails aren't wrapped/truncated
+    lo = xy.min(axis=1) - 3.0 * bw
+    hi = xy.max(axis=1) + 3.0 * bw
+    delta = (hi - lo) / ngrid
+    (counts, _, _) = np.histogram2d(xy[0], xy[1], bins=ngrid,
+                                    range=[[lo[0], hi[0]], [lo[1], hi[1]]])
+
+    # kernel on the grid offsets, out to 4 sigma
+    half = np.minimum(np.ceil(4.0 * bw / delta).astype(int), ngrid)
+    ox = np.arange(-half[0], half[0] + 1) * delta[0]
+    oy = np.arange(-half[1], half[1] + 1) * delta[1]
+    (dx, dy) = np.meshgrid(ox, oy, indexing="ij")
+    d = np.vstack([dx.ravel(), dy.ravel()])
+    inv_cov = np.linalg.inv(cov)
+    kernel = np.exp(-0.5 * np.sum(d * np.dot(inv_cov, d), axis=0))
+    kernel = kernel.reshape(dx.shape)
+    norm = n * 2.0 * np.pi * np.sqrt(np.linalg.det(cov))
+
+    grid = fftconvolve(counts, kernel, mode="same") / norm
+
+    # grid values sit at the cell centres
+    coords = (xy - lo[:,None]) / delta[:,None] - 0.5
+    z = map_coordinates(grid, coords, order=1, mode="nearest")
+
+    return np.maximum(z, 0.0)
@@ -10,7 +10,6 @@ import matplotlib.pyplot as plt
 import pandas as pd
 import datetime as dt
 import numpy as np
-from scipy.stats import gaussian_kde
 
 sys.path.append('Coupled_Canopy')
 from farq import FarquharC3
@@ -18,32 +17,18 @@ from solve_coupled_An_gs_leaf_temp_transpiration import CoupledModel
 from utils import vpd_to_rh, get_dewpoint, calc_esat
 from penman_monteith_leaf import calc_net_radiation
 import constants as c
+from plot_utils import calc_density, scatter, legend_handles
+from profiler import stage
+from wtc_data import get_model_data
+from results_store import allocate
 
 __author__  = "Martin De Kauwe"
 __version__ = "1.0 (16.04.2018)"
 __email__   = "mdekauwe@gmail.com"
 
-def main(fname):
+def main(fname, odir="plots"):
 
-    wtc = read_file(fname)
-
-    # create hourly values for subsequent averaging of fluxes
-    wtc["DateTime_hr"] = wtc["DateTime_hr"].apply(\
-                            lambda x: pd.to_datetime(x).round('30min'))
-    wtc_m = wtc.groupby(['DateTime_hr', 'chamber','T_treatment',
-                         'HWtrt','combotrt'], as_index=False).mean()
-    wtc_m = wtc_m.set_index('DateTime_hr')
-
-    st = pd.datetime.strptime('2016-10-20 00:00:00', '%Y-%m-%d %H:%M:%S')
-    en = pd.datetime.strptime('2016-11-11 20:00:00', '%Y-%m-%d %H:%M:%S')
-    wtc_m = wtc_m[(wtc_m.index >= st) & (wtc_m.index <= en)]
-
-    df_ct = wtc_m[(wtc_m["HWtrt"] == "C") & (wtc_m["PAR"] > 10.0)]
-    df_hw = wtc_m[(wtc_m["HWtrt"] == "HW") & (wtc_m["PAR"] > 10.0)]
-
-    PARlimit = 600
-    df_ct = df_ct[df_ct["PAR"] > PARlimit]
-    df_hw = df_hw[df_hw["PAR"] > PARlimit]
+    (df_ct, df_hw) = get_model_data(fname)
 
 
     # Parameters
@@ -78,27 +63,31 @@ def main(fname):
     C = CoupledModel(g0, g1, D0, gamma, Vcmax25, Jmax25, Rd25,
                      Eaj, Eav,deltaSj, deltaSv, Hdv, Hdj, Q10, leaf_width,
                      SW_abs, gs_model="medlyn")
-    Et_hw = []
-    An_hw = []
+    # 0: rnet from the model, 1: calculated from the sun's position
+    tair = df_hw.Tair_al.to_numpy()
+    par = df_hw.PAR.to_numpy()
+    vpd = df_hw.VPD.to_numpy()
+    doy = df_hw.index.dayofyear.to_numpy()
+    hour = df_hw.index.hour.to_numpy()
+    out = allocate(2, len(df_hw), np.float32)
     for i in range(len(df_hw)):
 
-        (An, gsw, et, LE) = C.main(df_hw.Tair_al[i], df_hw.PAR[i], df_hw.VPD[i],
-                                   wind, pressure, Ca, rnet=None)
-        Et_hw.append(et * c.MOL_2_MMOL) # mmol m-2 s-1
-        An_hw.append(An)                # umol m-2 s-1
+        (out["An"][0,i], out["gsw"][0,i],
+         out["et"][0,i], out["LE"][0,i]) = C.main(tair[i], par[i], vpd[i],
+                                                  wind, pressure, Ca,
+                                                  rnet=None)
 
-    Et_hw2 = []
-    An_hw2 = []
     for i in range(len(df_hw)):
-        ea = max(0.0, calc_esat(df_hw.Tair_al[i], pressure) -
-                 (df_hw.VPD[i] * c.KPA_2_PA))
-        rnet = calc_net_radiation(df_hw.index[i].dayofyear, df_hw.index[i].hour,
-                                  lat, lon, df_hw.PAR[i] * c.PAR_2_SW,
-                                  df_hw.Tair_al[i], ea)
-        (An, gsw, et, LE) = C.main(df_hw.Tair_al[i], df_hw.PAR[i], df_hw.VPD[i],
-                                   wind, pressure, Ca, rnet=rnet)
-        Et_hw2.append(et * c.MOL_2_MMOL) # mmol m-2 s-1
-        An_hw2.append(An)                # umol m-2 s-1
+        ea = max(0.0, calc_esat(tair[i], pressure) - (vpd[i] * c.KPA_2_PA))
+        rnet = calc_net_radiation(doy[i], hour[i], lat, lon,
+                                  par[i] * c.PAR_2_SW, tair[i], ea)
+        (out["An"][1,i], out["gsw"][1,i],
+         out["et"][1,i], out["LE"][1,i]) = C.main(tair[i], par[i], vpd[i],
+                                                  wind, pressure, Ca,
+                                                  rnet=rnet)
+
+    (Et_hw, Et_hw2) = out["et"] * c.MOL_2_MMOL # mmol m-2 s-1
+    (An_hw, An_hw2) = out["An"]                # umol m-2 s-1
 
 
     width  = 9
@@ -121,21 +110,20 @@ def main(fname):
     y = df_hw.Trans
     x = np.nan_to_num(x)
     y = np.nan_to_num(y)
-    xy = np.vstack([x, y])
-    z = gaussian_kde(xy)(xy)
-    ax1.scatter(x, y,  c=z, s=25, edgecolor='', cmap='Reds', alpha=0.7,
-                label="HW")
-    ax1.scatter(x, Et_hw, color='black', s=5, alpha=0.7, label="Model")
-    ax1.scatter(x, Et_hw2, color='green', s=5, alpha=0.7,
-                label="Varying R$_{net}$")
+    z = calc_density(x, y)
+    scatter(ax1, x, y,  c=z, s=25, edgecolor='', cmap='Reds', alpha=0.7,
+                 label="HW")
+    scatter(ax1, x, Et_hw, color='black', s=5, alpha=0.7, label="Model")
+    scatter(ax1, x, Et_hw2, color='green', s=5, alpha=0.7,
+                 label="Varying R$_{net}$")
 
     ax1.legend(scatterpoints=1, loc="upper right", frameon=False,
                handletextpad=0.1)
-    legend = ax1.get_legend()
-    legend.legendHandles[0].set_color("red")
-    legend.legendHandles[0]._sizes = [60]
-    legend.legendHandles[1]._sizes = [60]
-    legend.legendHandles[2]._sizes = [60]
+    handles = legend_handles(ax1.get_legend())
+    handles[0].set_color("red")
+    handles[0]._sizes = [60]
+    handles[1]._sizes = [60]
+    handles[2]._sizes = [60]
 
     ax1.locator_params(nbins=4, axis='x')
     ax1.locator_params(nbins=4, axis='y')
@@ -146,28 +134,14 @@ def main(fname):
     ax1.set_ylabel('E$_{canopy}$ (mmol m$^{-2}$ s$^{-1}$)')
     ax1.set_xlabel('Canopy temperature ($^\circ$C)')
 
-    #fig.savefig("plots/increasing_g0.pdf", bbox_inches='tight',
-    #            pad_inches=0.1)
-    fig.savefig("plots/varying_rnet.png", dpi=300, bbox_inches='tight',
-                pad_inches=0.1)
+    with stage("savefig"):
+        fig.savefig(os.path.join(odir, "varying_rnet.pdf"), dpi=300,
+                    bbox_inches='tight', pad_inches=0.1)
+        fig.savefig(os.path.join(odir, "varying_rnet.png"), dpi=300,
+                    bbox_inches='tight', pad_inches=0.1)
     #plt.show()
 
 
-def read_file(fname):
-
-    df = pd.read_csv(fname)
-    df['dates'] = pd.to_datetime(df['DateTime_hr'], format='%Y-%m-%d %H:%M:%S')
-    df = df.set_index('dates')
-    df.drop("DateTime_hr", inplace=True)
-    df["year"] = df.index.year
-    df["month"] = df.index.month
-    df["day"] = df.index.day
-    df["doy"] = df.index.dayofyear
-    df["hour"] = df.index.hour
-
-    return df
-
-
 if __name__== "__main__":
 
     fdir = "raw_data"
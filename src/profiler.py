@@ -0,0 +1,182 @@
+#!/usr/bin/env python
+
+"""
+Per-stage timing & memory of the data/model/plot pipeline.
+
+The shared code marks its stages (CSV parse, rounding the timestamps,
+groupby, KDE, model, savefig) with stage(name), which does nothing unless a
+Profiler is running, e.g.
+
+    with Profiler() as prof:
+        plot_modelling.main(fname)
+    prof.save("plots/profile.json")   # or .csv
+
+or from the command line, for one plot script
+
+    python src/profiler.py plot_modelling [report.json]
+
+Memory is tracked with tracemalloc (the peak Python allocation above what
+was in use when the stage started), which slows things down, so use
+memory=False for clean timings. Stages named in cprofile are also run under
+cProfile, with the stats dumped to odir for pstats/snakeviz.
+"""
+
+import os
+import sys
+import csv
+import json
+import time
+import cProfile
+import importlib
+import tracemalloc
+from contextlib import contextmanager, nullcontext
+
+__author__  = "Martin De Kauwe"
+__version__ = "1.0 (18.10.2026)"
+__email__   = "mdekauwe@gmail.com"
+
+FIELDS = ["stage", "path", "seconds", "mem_peak_mb", "mem_delta_mb"]
+
+# Profiler currently running, if any
+_ACTIVE = None
+
+def stage(name):
+    """ Context marking a pipeline stage, free if we aren't profiling """
+    if _ACTIVE is None:
+        return nullcontext()
+
+    return _ACTIVE.stage(name)
+
+class Profiler(object):
+    """Records the wall time & memory of each stage while it is running."""
+
+    def __init__(self, memory=True, cprofile=("model",), odir="profiles"):
+
+        self.memory = memory
+        self.cprofile = set(cprofile)
+        self.odir = odir
+        self.records = []
+        self.stack = []
+        self.profiling = False
+        self.ndumps = 0
+
+    def start(self):
+        global _ACTIVE
+        if _ACTIVE is not None:
+            raise RuntimeError("A Profiler is already running")
+        if self.memory:
+            tracemalloc.start()
+        _ACTIVE = self
+
+    def stop(self):
+        global _ACTIVE
+        if self.memory:
+            tracemalloc.stop()
+        _ACTIVE = None
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.stop()
+
+    @contextmanager
+    def stage(self, name):
+        entry = {"stage": name,
+                 "path": "/".join([v["stage"] for v in self.stack] + [name])}
+        if self.memory:
+            (current, peak) = tracemalloc.get_traced_memory()
+            if self.stack:
+                self.stack[-1]["peak"] = max(self.stack[-1]["peak"], peak)
+            tracemalloc.reset_peak()
+            entry["mem0"] = entry["peak"] = current
+        self.stack.append(entry)
+
+        # only one cProfile can run at a time, so not nested
+        prof = None
+        if name in self.cprofile and not self.profiling:
+            prof = cProfile.Profile()
+            self.profiling = True
+            prof.enable()
+
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            seconds = time.perf_counter() - start
+            if prof is not None:
+                prof.disable()
+                self.profiling = False
+                self.dump(prof, name)
+
+            self.stack.pop()
+            record = {"stage": name, "path": entry["path"],
+                      "seconds": seconds, "mem_peak_mb": None,
+                      "mem_delta_mb": None}
+            if self.memory:
+                (current, peak) = tracemalloc.get_traced_memory()
+                peak = max(entry["peak"], peak)
+                if self.stack:
+                    self.stack[-1]["peak"] = max(self.stack[-1]["peak"], peak)
+                record["mem_peak_mb"] = (peak - entry["mem0"]) / 1E6
+                record["mem_delta_mb"] = (current - entry["mem0"]) / 1E6
+            self.records.append(record)
+
+    def dump(self, prof, name):
+        if not os.path.exists(self.odir):
+            os.makedirs(self.odir)
+        ofname = os.path.join(self.odir, "%s_%d_%d.prof" % (name, os.getpid(),
+                                                            self.ndumps))
+        prof.dump_stats(ofname)
+        self.ndumps += 1
+
+    def summary(self):
+        """ {path: {"calls", "seconds", "mem_peak_mb"}}, totalled """
+        out = {}
+        for r in self.records:
+            s = out.setdefault(r["path"], {"calls": 0, "seconds": 0.0,
+                                           "mem_peak_mb": None})
+            s["calls"] += 1
+            s["seconds"] += r["seconds"]
+            if r["mem_peak_mb"] is not None:
+                s["mem_peak_mb"] = max(s["mem_peak_mb"] or 0.0,
+                                       r["mem_peak_mb"])
+        return out
+
+    def report(self):
+        print("%-40s %6s %10s %12s" % ("stage", "calls", "seconds",
+                                       "peak (MB)"))
+        for path, s in self.summary().items():
+            print("%-40s %6d %10.3f %12s" %
+                  (path, s["calls"], s["seconds"],
+                   "-" if s["mem_peak_mb"] is None
+                   else "%.1f" % (s["mem_peak_mb"])))
+
+    def save(self, ofname):
+        """ Write every stage record, as CSV if ofname ends .csv else JSON """
+        if ofname.endswith(".csv"):
+            with open(ofname, "w", newline="") as f:
+                writer = csv.DictWriter(f, fieldnames=FIELDS)
+                writer.writeheader()
+                writer.writerows(self.records)
+        else:
+            with open(ofname, "w") as f:
+                json.dump({"records": self.records,
+                           "summary": self.summary()}, f, indent=1)
+
+
+if __name__== "__main__":
+
+    # the pipeline looks for the running Profiler in the imported module,
+    # not this __main__ copy of it
+    import profiler
+    from wtc_data import get_fname
+
+    module = importlib.import_module(sys.argv[1])
+    with profiler.Profiler() as prof:
+        with profiler.stage(sys.argv[1]):
+            module.main(get_fname())
+    prof.report()
+    if len(sys.argv) > 2:
+        prof.save(sys.argv[2])
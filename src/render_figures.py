@@ -0,0 +1,144 @@
+#!/usr/bin/env python
+
+"""
+Regenerate every figure in one go, without a display.
+
+The flux data are read, averaged and indexed once, and the baseline model
+run the sensitivity figures share is solved once, before the figures are
+farmed out to worker processes. Where processes are forked (Linux) the
+workers inherit all of that rather than redoing it; elsewhere each worker
+rebuilds it on first use. Each figure is written to odir (plots/ by
+default) by its script. With profile set, a per-stage timing/memory report
+of every figure is written too (see profiler.py).
+
+    python src/render_figures.py                 # everything
+    python src/render_figures.py modelling g0_func_T
+"""
+
+import os
+import sys
+import time
+import importlib
+import multiprocessing as mp
+from concurrent.futures import ProcessPoolExecutor
+
+import matplotlib
+matplotlib.use("Agg")
+import matplotlib.pyplot as plt
+
+import profiler
+from wtc_data import read_file, get_model_data, get_fname
+from sweep import run_sweep
+
+__author__  = "Martin De Kauwe"
+__version__ = "1.0 (18.10.2026)"
+__email__   = "mdekauwe@gmail.com"
+
+# figure name: plot script
+FIGURES = {
+    "A_E_timeseries": "plot_A_E_timeseries",
+    "tair_vpd": "plot_tair_vpd",
+    "modelling": "plot_modelling",
+    "increase_g0": "plot_increase_g0",
+    "g0_func_T": "plot_g0_func_T",
+    "lower_wind_speed": "plot_lower_wind_speed",
+    "wider_leaves": "plot_wider_leaves",
+    "topt_hack": "plot_topt_hack",
+    "varying_rnet": "plot_varying_rnet",
+}
+
+def main(fname, names=None, nworkers=None, odir="plots", profile=None):
+    """
+    Parameters:
+    ----------
+    fname : string
+        path to the WTC flux file
+    names : list
+        figures to render (keys of FIGURES), None for all of them
+    nworkers : int
+        number of worker processes, None for one per CPU (up to the number
+        of figures), 1 renders everything in this process
+    odir : string
+        where the plot scripts write to
+    profile : string
+        write a per-stage profile of each figure to this .json/.csv file,
+        None to not profile
+
+    Returns:
+    --------
+    timings : dict
+        wall time (s) to render each figure
+    """
+    names = list(FIGURES) if names is None else list(names)
+    for name in names:
+        if name not in FIGURES:
+            raise KeyError("Unknown figure: %s" % (name))
+    if nworkers is None:
+        nworkers = min(len(names), os.cpu_count() or 1)
+
+    if not os.path.exists(odir):
+        os.makedirs(odir)
+
+    prepare(fname)
+
+    timings = {}
+    records = []
+    if nworkers == 1:
+        for name in names:
+            (timings[name], recs) = render(name, fname, odir,
+                                           profile is not None)
+            records.extend(recs)
+    else:
+        context = (mp.get_context("fork")
+                   if "fork" in mp.get_all_start_methods() else None)
+        with ProcessPoolExecutor(max_workers=nworkers,
+                                 mp_context=context) as executor:
+            futures = [executor.submit(render, name, fname, odir,
+                                       profile is not None)
+                       for name in names]
+            for name, future in zip(names, futures):
+                (timings[name], recs) = future.result()
+                records.extend(recs)
+
+    if profile is not None:
+        prof = profiler.Profiler()
+        prof.records = records
+        prof.save(profile)
+
+    return timings
+
+def prepare(fname):
+    """ Load what the figures share into this process """
+    read_file(fname, ["chamber"])
+    (df_ct, df_hw) = get_model_data(fname)
+    run_sweep(df_hw, [{}])
+
+def render(name, fname, odir="plots", profile=False):
+    """
+    Run one plot script, returning how long it took and, if profiling, the
+    stage records
+    """
+    start = time.time()
+    module = importlib.import_module(FIGURES[name])
+    prof = profiler.Profiler() if profile else None
+    if prof is not None:
+        prof.start()
+    with plt.rc_context():
+        try:
+            with profiler.stage(name):
+                module.main(fname, odir)
+        finally:
+            plt.close("all")
+            if prof is not None:
+                prof.stop()
+
+    return (time.time() - start, [] if prof is None else prof.records)
+
+
+if __name__== "__main__":
+
+    start = time.time()
+    timings = main(get_fname(), sys.argv[1:] or None)
+    for name, secs in timings.items():
+        print("%-20s %8.1f s" % (name, secs))
+    print("%-20s %8.1f s" % ("total", time.time() - start))
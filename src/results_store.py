@@ -0,0 +1,80 @@
+#!/usr/bin/env python
+
+"""
+Compact store of model results: one record per (scenario, row) holding An,
+gsw, et, LE and Tleaf, as float64 or float32, in a numpy structured array
+that can be backed by a .npy file, e.g.
+
+    out = allocate(len(scenarios), len(df), np.float32, "results.npy")
+    run_sweep(df, scenarios, out=out)
+    out.flush()
+
+and later, memory-mapped rather than read in
+
+    out = load("results.npy")
+    et = out["et"][j] # scenario j, every row
+
+A field indexes like the dict of arrays run_sweep used to return, i.e.
+out["et"] is (nscenarios, nrows). In float32 a record is 28 bytes, against
+48 in float64 (or ~150 as python floats in lists).
+"""
+
+import numpy as np
+import pandas as pd
+
+__author__  = "Martin De Kauwe"
+__version__ = "1.0 (18.10.2026)"
+__email__   = "mdekauwe@gmail.com"
+
+OUTPUTS = ["An", "gsw", "et", "LE", "Tleaf"]
+
+def results_dtype(precision=np.float64):
+    """ Record of a scenario/row's results, outputs as precision """
+    return np.dtype([("scenario", np.int32), ("row", np.int32)] +
+                    [(v, precision) for v in OUTPUTS])
+
+def allocate(nscenarios, nrows, precision=np.float64, fname=None):
+    """
+    Results array to fill, outputs set to NaN.
+
+    Parameters:
+    ----------
+    nscenarios : int
+        number of scenarios
+    nrows : int
+        number of forcing rows each scenario is run over
+    precision : dtype
+        of the outputs, np.float32 halves the size
+    fname : string
+        .npy file to memory-map the array to, None keeps it in memory
+
+    Returns:
+    --------
+    out : structured array (or np.memmap)
+        (nscenarios, nrows) of results_dtype records
+    """
+    dtype = results_dtype(precision)
+    shape = (nscenarios, nrows)
+    if fname is None:
+        out = np.empty(shape, dtype=dtype)
+    else:
+        out = np.lib.format.open_memmap(fname, mode="w+", dtype=dtype,
+                                        shape=shape)
+
+    out["scenario"] = np.arange(nscenarios)[:,np.newaxis]
+    out["row"] = np.arange(nrows)
+    for v in OUTPUTS:
+        out[v] = np.nan
+
+    return out
+
+def load(fname, mmap_mode="r"):
+    """ Results saved by allocate (or np.save), mapped rather than read """
+    return np.load(fname, mmap_mode=mmap_mode)
+
+def to_frame(out, scenario, index=None):
+    """
+    One scenario's results as a dataframe, optionally indexed like the
+    forcing rows so they can be joined back onto them
+    """
+    return pd.DataFrame({v: out[v][scenario] for v in OUTPUTS}, index=index)
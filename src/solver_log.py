@@ -0,0 +1,125 @@
+#!/usr/bin/env python
+
+"""
+Opt-in record of how the CoupledModel solvers got on: iterations, final
+|dTleaf| residual, wall time and whether each solve converged.
+
+Attach a log to a model and every row it solves is appended, in row order,
+so a log cleared before a run lines up with that run's input rows, e.g.
+
+    log = SolverLog()
+    C = CoupledModel(..., log=log)
+    C.main_batch(df.Tair_al, df.PAR, df.VPD, wind, pressure, Ca)
+    diag = log.to_frame(df.index).join(df[["Tair_al", "VPD"]])
+
+Without a log the solvers skip all of this.
+"""
+
+import numpy as np
+import pandas as pd
+
+__author__  = "Martin De Kauwe"
+__version__ = "1.0 (18.10.2026)"
+__email__   = "mdekauwe@gmail.com"
+
+# status codes
+CONVERGED = 0
+FAILED = 1        # hit iter_max (main_secant returns its best estimate)
+COLD_RESTART = 2  # main_timeseries warm start failed, converged from cold
+
+DTYPE = np.dtype([("call", np.int32),       # solver call the row was in
+                  ("iters", np.int32),
+                  ("residual", np.float32), # |Tleaf - new Tleaf| (deg C)
+                  ("seconds", np.float32),
+                  ("status", np.int8)])
+
+class SolverLog(object):
+    """Growable structured array of per-row solver diagnostics."""
+
+    def __init__(self, size=1024):
+
+        self.data = np.zeros(size, dtype=DTYPE)
+        self.n = 0
+        self.ncalls = 0
+
+    def record(self, iters, residual, seconds, status):
+        """ A single row, as its own call """
+        self.reserve(1)
+        self.data[self.n] = (self.ncalls, iters, residual, seconds, status)
+        self.n += 1
+        self.ncalls += 1
+
+    def record_batch(self, iters, residual, seconds, status):
+        """ Rows solved together in one call, arrays or scalars """
+        n = len(np.atleast_1d(iters))
+        self.reserve(n)
+        rows = self.data[self.n:self.n + n]
+        rows["call"] = self.ncalls
+        rows["iters"] = iters
+        rows["residual"] = residual
+        rows["seconds"] = seconds
+        rows["status"] = status
+        self.n += n
+        self.ncalls += 1
+
+    def reserve(self, n):
+        if self.n + n > len(self.data):
+            size = max(2 * len(self.data), self.n + n)
+            data = np.zeros(size, dtype=DTYPE)
+            data[:self.n] = self.data[:self.n]
+            self.data = data
+
+    def to_array(self):
+        return self.data[:self.n].copy()
+
+    def to_frame(self, index=None):
+        """
+        Log as a dataframe, optionally indexed like the input rows, so it
+        can be joined back onto them
+        """
+        if index is not None and len(index) != self.n:
+            raise ValueError("Log has %d rows, index has %d" %
+                             (self.n, len(index)))
+
+        return pd.DataFrame(self.to_array(), index=index)
+
+    def binned(self, x, y, xbins, ybins, field="iters"):
+        """
+        Mean of field over a grid of the inputs, e.g. solver cost over
+        Tair x VPD.
+
+        Parameters:
+        ----------
+        x, y : arrays
+            input values of the logged rows, e.g. tair & vpd
+        xbins, ybins : arrays
+            bin edges
+        field : string
+            iters, residual, seconds or status (status > 0 gives the
+            fraction of rows that didn't converge first time)
+
+        Returns:
+        --------
+        grid : array
+            (len(xbins) - 1, len(ybins) - 1), NaN where there are no rows
+        """
+        values = self.data[field][:self.n].astype(np.float64)
+        if field == "status":
+            values = (values > 0).astype(np.float64)
+        (total, _, _) = np.histogram2d(x, y, bins=[xbins, ybins],
+                                       weights=values)
+        (count, _, _) = np.histogram2d(x, y, bins=[xbins, ybins])
+        with np.errstate(invalid="ignore", divide="ignore"):
+            return total / count
+
+    def clear(self):
+        self.n = 0
+        self.ncalls = 0
+
+    def __len__(self):
+        return self.n
+
+    def __repr__(self):
+        status = self.data["status"][:self.n]
+        return ("SolverLog(rows=%d, calls=%d, failed=%d)" %
+                (self.n, self.ncalls, np.count_nonzero(status == FAILED)))
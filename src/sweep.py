@@ -0,0 +1,379 @@
+#!/usr/bin/env python
+
+"""
+Run the coupled model for a set of parameter/forcing scenarios over the same
+rows of chamber data, i.e. what the sensitivity plots need.
+
+A scenario is a dict of overrides on top of PARAMS (CoupledModel parameters)
+and FORCING (wind, pressure, Ca, Topt_hack), e.g.
+
+    scenarios = [{}, {"g0": 0.03}, {"wind": 3.0},
+                 {"leaf_width": 0.1, "wind": 3.0}]
+
+An override can also be a function of the forcing dataframe, returning a
+value per row, e.g. {"g0": lambda df: arrh(0.003, 100000, Tk)}. Parameters
+in FUNCS are functions themselves and passed to the model as they are, e.g.
+{"g0_func": partial(arrh, 0.003, 100000.)} gives g0 from each row's Tair
+(worked out inside the solve by a model with main_batch).
+
+Scenarios and chunks of rows are independent, so with nworkers > 1 they are
+farmed out to a process pool. Results of plain (no functions or arrays)
+scenarios are also kept for the session, so the baseline that every figure
+repeats is only solved once per set of rows.
+
+Results come back as a results_store structured array, which can be
+float32 and/or memory-mapped to a file for big ensembles.
+
+The figures use the Coupled_Canopy CoupledModel, which solves one row at a
+time. Pass model=backup_how_i_did_topt.CoupledModel for the local copy with
+the batch solver, which is much faster but a different implementation (e.g.
+it has no rnet path), so check it against the figures before switching.
+"""
+
+import sys
+import hashlib
+import numpy as np
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+
+sys.path.append('Coupled_Canopy')
+from solve_coupled_An_gs_leaf_temp_transpiration import CoupledModel
+import constants as c
+from wtc_data import iter_chamber_means, screen, MODEL_COLUMNS
+from results_store import allocate, OUTPUTS
+from model_cache import stable_key
+from profiler import stage
+
+__author__  = "Martin De Kauwe"
+__version__ = "1.0 (18.10.2026)"
+__email__   = "mdekauwe@gmail.com"
+
+# Parameters used across all the figures
+PARAMS = {
+    # gs stuff
+    "g0": 0.003,
+    "g1": 2.9,
+    "D0": 1.5,      # Not used
+    "gamma": 0.0,   # Not used
+    "gs_model": "medlyn",
+
+    # A stuff
+    "Vcmax25": 34.0,
+    "Jmax25": 60.0,
+    "Rd25": 0.92,
+    "Eaj": 21640.,
+    "Eav": 51780.,
+    "deltaSj": 633.0,
+    "deltaSv": 640.0,
+    "Hdv": 200000.0,
+    "Hdj": 200000.0,
+    "Q10": 1.92,
+
+    # Misc stuff
+    "leaf_width": 0.01,
+    "SW_abs": 0.86, # absorptance to short_wave rad [0,1], typically 0.4-0.6
+
+    # g0 = f(Tair K), None for a fixed g0
+    "g0_func": None,
+}
+
+# Parameters that are functions, rather than functions to evaluate on df
+FUNCS = ["g0_func"]
+
+# variables though obviously fixed here.
+FORCING = {
+    "wind": 8.0,
+    "pressure": 100.0 * c.KPA_2_PA,
+    "Ca": 400.,
+    "Topt_hack": False,
+}
+
+# Results of plain scenarios already solved this session, see result_key.
+# Least recently used ones are dropped beyond MEMO_SIZE scenarios.
+MEMO_SIZE = 64
+_RESULTS = OrderedDict()
+
+def run_sweep(df, scenarios, params=PARAMS, forcing=FORCING, nworkers=1,
+              chunksize=None, cache=None, out=None, precision=np.float64,
+              model=CoupledModel, memo=True):
+    """
+    Run every scenario over the rows of df.
+
+    Parameters:
+    ----------
+    df : dataframe
+        forcing, needs Tair_al, PAR and VPD columns
+    scenarios : list of dicts
+        parameter/forcing overrides, one dict per scenario
+    params : dict
+        baseline CoupledModel parameters
+    forcing : dict
+        baseline fixed forcing
+    nworkers : int
+        number of worker processes, 1 solves everything in this process
+    chunksize : int
+        number of rows per task when running in parallel. By default each
+        scenario is a single task.
+    cache : ResultCache
+        memoise results across scenarios/calls (only used when nworkers is
+        1, as the workers can't share it, and with a model that has
+        main_batch). It only keeps the fluxes, so Tleaf is left NaN.
+    out : structured array
+        (nscenarios, nrows) array from results_store.allocate to write the
+        results to, e.g. memory-mapped to a file. By default one is
+        allocated.
+    precision : dtype
+        of the outputs when allocating out
+    model : class
+        CoupledModel implementation to solve with, by default the
+        Coupled_Canopy one. Without a main_batch, rows are solved one at a
+        time and Tleaf is left NaN.
+    memo : bool
+        reuse, and keep, whole-scenario results from earlier calls this
+        session (the last MEMO_SIZE are kept). Turn off when each call is
+        a one-off, e.g. successive chunks of a record.
+
+    Returns:
+    --------
+    out : structured array
+        results_store records, shaped (nscenarios, nrows), so out["et"] is
+        the (nscenarios, nrows) transpiration
+    """
+    nrows = len(df)
+    if out is None:
+        out = allocate(len(scenarios), nrows, precision)
+    elif out.shape != (len(scenarios), nrows):
+        raise ValueError("out is %s, needs to be (%d, %d)" %
+                         (out.shape, len(scenarios), nrows))
+    tair = df.Tair_al.values
+    par = df.PAR.values
+    vpd = df.VPD.values
+
+    # identical scenarios (e.g. the baseline in each figure) are only solved
+    # once, and written to each of their slots in out
+    unique = {}
+    slots = {}
+    for j, scenario in enumerate(scenarios):
+        key = scenario_key(scenario)
+        if key not in unique:
+            unique[key] = split_scenario(scenario, params, forcing, df)
+        slots.setdefault(key, []).append(j)
+
+    # a ResultCache memoises (quantised) results itself
+    saved = {key: None if cache is not None or not memo else
+                  result_key(*unique[key], tair=tair, par=par, vpd=vpd,
+                             model=model)
+             for key in unique}
+    done = {}
+    todo = []
+    for key in unique:
+        if saved[key] is not None and saved[key] in _RESULTS:
+            _RESULTS.move_to_end(saved[key])
+            put(out, slots[key], slice(None), _RESULTS[saved[key]])
+        else:
+            todo.append(key)
+            if saved[key] is not None:
+                done[key] = np.full((len(OUTPUTS), nrows), np.nan)
+
+    def collect(key, rows, results):
+        put(out, slots[key], rows, results)
+        if key in done:
+            done[key][:,rows] = results
+
+    if chunksize is None:
+        chunksize = max(1, nrows)
+    tasks = [(key, slice(i, i + chunksize)) for key in todo
+             for i in range(0, nrows, chunksize)]
+
+    with stage("model"):
+        if nworkers == 1:
+            for key, rows in tasks:
+                (p, f) = unique[key]
+                collect(key, rows, solve(tair[rows], par[rows], vpd[rows],
+                                         take_rows(p, rows),
+                                         take_rows(f, rows), cache, model))
+        else:
+            with ProcessPoolExecutor(max_workers=nworkers) as executor:
+                futures = []
+                for key, rows in tasks:
+                    (p, f) = unique[key]
+                    futures.append(executor.submit(solve, tair[rows],
+                                                   par[rows], vpd[rows],
+                                                   take_rows(p, rows),
+                                                   take_rows(f, rows),
+                                                   model=model))
+
+                # collect in submission order so the results don't depend on
+                # which worker finished first
+                for (key, rows), future in zip(tasks, futures):
+                    collect(key, rows, future.result())
+
+    for key, results in done.items():
+        _RESULTS[saved[key]] = results
+        while len(_RESULTS) > MEMO_SIZE:
+            _RESULTS.popitem(last=False)
+
+    return out
+
+def put(out, slots, rows, results):
+    """ Write (len(OUTPUTS), nrows) results to the scenarios in slots """
+    for v, values in zip(OUTPUTS, results):
+        out[v][slots,rows] = values
+
+def run_sweep_stream(fname, ofname, scenarios, params=PARAMS,
+                     forcing=FORCING, PARlimit=600, chunksize=100000,
+                     cache=None, model=CoupledModel):
+    """
+    Streaming version of run_sweep straight from the flux file: the CSV is
+    read, averaged to 30 min, screened and run through the model a chunk
+    at a time, with the results appended to ofname as we go. Memory use is
+    set by chunksize, not the length of the record.
+
+    Parameters:
+    ----------
+    fname : string
+        path to the WTC flux CSV, each chamber in time order
+    ofname : string
+        output CSV, the 30 min chamber means plus An_j, gsw_j, et_j, LE_j
+        & Tleaf_j columns for each scenario j
+    scenarios : list of dicts
+        parameter/forcing overrides, one dict per scenario
+    params : dict
+        baseline CoupledModel parameters
+    forcing : dict
+        baseline fixed forcing
+    PARlimit : float
+        only keep timesteps with PAR above this (umol m-2 s-1)
+    chunksize : int
+        number of CSV rows to read at a time
+    cache : ResultCache
+        memoise results across chunks
+    model : class
+        CoupledModel implementation, see run_sweep
+
+    Returns:
+    --------
+    nrows : int
+        number of rows written
+    """
+    nrows = 0
+    with open(ofname, "w") as f:
+        for wtc_m in iter_chamber_means(fname, "30min", MODEL_COLUMNS,
+                                        chunksize):
+            df = screen(wtc_m, PARlimit)
+            if len(df) == 0:
+                continue
+
+            # each chunk's rows are only seen once, so don't memoise them
+            out = run_sweep(df, scenarios, params, forcing, cache=cache,
+                            model=model, memo=False)
+            df = df.copy()
+            for v in OUTPUTS:
+                for j in range(len(scenarios)):
+                    df["%s_%d" % (v, j)] = out[v][j]
+            df.to_csv(f, header=(nrows == 0), index_label="DateTime_hr")
+            nrows += len(df)
+
+    return nrows
+
+def solve(tair, par, vpd, params, forcing, cache=None, model=CoupledModel):
+    """
+    Solve a single scenario over a set of rows, parameters given per row
+    are passed to the model as arrays
+
+    Returns:
+    --------
+    results : array
+        (len(OUTPUTS), nrows)
+    """
+    if not hasattr(model, "main_batch"):
+        return solve_rows(tair, par, vpd, params, forcing, model)
+
+    C = model(**params)
+
+    # the cache keys on fixed parameters, so can't hold per-row ones
+    per_row = any(np.ndim(v) > 0 for v in params.values())
+    if cache is not None and not per_row:
+        (An, gsw, et, LE) = cache.main_batch(C, tair, par, vpd,
+                                             forcing["wind"],
+                                             forcing["pressure"],
+                                             forcing["Ca"],
+                                             Topt_hack=forcing["Topt_hack"])
+        return np.array([An, gsw, et, LE, np.full(len(tair), np.nan)])
+
+    res = np.empty(len(tair), dtype=[(v, np.float64) for v in OUTPUTS])
+    C.main_batch(tair, par, vpd, forcing["wind"], forcing["pressure"],
+                 forcing["Ca"], Topt_hack=forcing["Topt_hack"], out=res)
+
+    return np.array([res[v] for v in OUTPUTS])
+
+def solve_rows(tair, par, vpd, params, forcing, model=CoupledModel):
+    """
+    solve for a model that only does a row at a time (i.e. main), as the
+    plot scripts used to, setting any per-row parameters on the one model
+    before each row
+    """
+    p = dict(params)
+    g0_func = p.pop("g0_func", None)
+    if g0_func is not None:
+        p["g0"] = g0_func(np.asarray(tair) + c.DEG_2_KELVIN)
+    per_row = [k for k, v in p.items() if np.ndim(v) > 0]
+    (wind, pressure, Ca) = [np.broadcast_to(forcing[k], len(tair))
+                            for k in ("wind", "pressure", "Ca")]
+
+    results = np.full((len(OUTPUTS), len(tair)), np.nan)
+    C = model(**dict(p, **{k: p[k][0] for k in per_row}))
+    for i in range(len(tair)):
+        for k in per_row:
+            setattr(C, k, p[k][i])
+        results[:4,i] = C.main(tair[i], par[i], vpd[i], wind[i], pressure[i],
+                               Ca[i], Topt_hack=forcing["Topt_hack"])
+
+    return results
+
+def take_rows(d, rows):
+    """ Slice any per-row values in a params/forcing dict """
+    return {k: v[rows] if np.ndim(v) > 0 else v for k, v in d.items()}
+
+def split_scenario(scenario, params, forcing, df):
+    """ Apply the scenario overrides to the baseline params & forcing """
+    p = dict(params)
+    f = dict(forcing)
+    for k, v in scenario.items():
+        if callable(v) and k not in FUNCS:
+            v = np.asarray(v(df), dtype=np.float64)
+        if k in f:
+            f[k] = v
+        elif k in p:
+            p[k] = v
+        else:
+            raise KeyError("Unknown scenario parameter: %s" % (k))
+
+    return (p, f)
+
+def result_key(params, forcing, tair, par, vpd, model=CoupledModel):
+    """
+    Key of a scenario's results on a set of rows, from the values of its
+    parameters & forcing and the model. None if any of them vary by row, or
+    are functions that can't be keyed, see model_cache.stable_key.
+    """
+    items = sorted(params.items()) + sorted(forcing.items())
+    if any(np.ndim(v) > 0 for (k, v) in items):
+        return None
+    try:
+        items = [(k, stable_key(v, k)) for (k, v) in items]
+    except ValueError:
+        return None
+
+    h = hashlib.md5()
+    for v in (tair, par, vpd):
+        h.update(np.ascontiguousarray(v, dtype=np.float64).tobytes())
+
+    return (tuple((k, np.asarray(v).item() if isinstance(v, np.ndarray)
+                   else v) for (k, v) in items), len(tair), h.hexdigest(),
+            "%s.%s" % (model.__module__, model.__qualname__))
+
+def scenario_key(scenario):
+    # functions & arrays aren't hashable, so key them on identity
+    return tuple(sorted((k, id(v) if callable(v) or np.ndim(v) > 0 else v)
+                        for k, v in scenario.items()))
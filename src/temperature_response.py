@@ -0,0 +1,94 @@
+#!/usr/bin/env python
+
+"""
+Temperature responses of the kinetic parameters, shared by the model and
+plot scripts. Everything works on scalars or numpy arrays (broadcast
+against each other), so a whole timeseries can be done in one call.
+"""
+
+import numpy as np
+
+import constants as c
+
+__author__  = "Martin De Kauwe"
+__version__ = "1.0 (18.10.2026)"
+__email__   = "mdekauwe@gmail.com"
+
+def arrh(k25, Ea, Tk):
+    """ Temperature dependence of kinetic parameters is described by an
+    Arrhenius function.
+
+    Parameters:
+    ----------
+    k25 : float or array
+        rate parameter value at 25 degC or 298 K
+    Ea : float or array
+        activation energy for the parameter [J mol-1]
+    Tk : float or array
+        leaf temperature [deg K]
+
+    Returns:
+    -------
+    kt : float or array
+        temperature dependence on parameter
+
+    References:
+    -----------
+    * Medlyn et al. 2002, PCE, 25, 1167-1179.
+    """
+    Tk = np.asarray(Tk, dtype=np.float64)
+    return k25 * np.exp((Ea * (Tk - 298.15)) / (298.15 * c.RGAS * Tk))
+
+def peaked_arrh(k25, Ea, Tk, deltaS, Hd):
+    """ Temperature dependancy approximated by peaked Arrhenius eqn,
+    accounting for the rate of inhibition at higher temperatures.
+
+    Parameters:
+    ----------
+    k25 : float or array
+        rate parameter value at 25 degC or 298 K
+    Ea : float or array
+        activation energy for the parameter [J mol-1]
+    Tk : float or array
+        leaf temperature [deg K]
+    deltaS : float or array
+        entropy factor [J mol-1 K-1)
+    Hd : float or array
+        describes rate of decrease about the optimum temp [J mol-1]
+
+    Returns:
+    -------
+    kt : float or array
+        temperature dependence on parameter
+
+    References:
+    -----------
+    * Medlyn et al. 2002, PCE, 25, 1167-1179.
+    """
+    Tk = np.asarray(Tk, dtype=np.float64)
+    arg1 = arrh(k25, Ea, Tk)
+    arg2 = 1.0 + np.exp((298.15 * deltaS - Hd) / (298.15 * c.RGAS))
+    arg3 = 1.0 + np.exp((Tk * deltaS - Hd) / (Tk * c.RGAS))
+
+    return arg1 * arg2 / arg3
+
+def q10(k25, Q10, Tk):
+    """ Q10 temperature response, i.e. the rate multiplies by Q10 for
+    every 10 degrees.
+
+    Parameters:
+    ----------
+    k25 : float or array
+        rate parameter value at 25 degC or 298 K
+    Q10 : float or array
+        factor the rate increases by for a 10 degree rise
+    Tk : float or array
+        leaf temperature [deg K]
+
+    Returns:
+    -------
+    kt : float or array
+        temperature dependence on parameter
+    """
+    Tk = np.asarray(Tk, dtype=np.float64)
+    return k25 * Q10**((Tk - 298.15) / 10.0)
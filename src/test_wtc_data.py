@@ -0,0 +1,154 @@
+#!/usr/bin/env python
+
+"""
+Check the wtc_data selections & caches against the plain pandas versions,
+on small synthetic chamber data, e.g.
+
+    python test_wtc_data.py
+"""
+
+import os
+import shutil
+import zipfile
+import tempfile
+import unittest
+import numpy as np
+import pandas as pd
+
+import wtc_data
+from wtc_data import ChamberIndex, START, END
+
+__author__  = "Martin De Kauwe"
+__version__ = "1.0 (18.10.2026)"
+__email__   = "mdekauwe@gmail.com"
+
+def make_chamber_means(ntimes=200, seed=0):
+    """ Half-hourly chamber means of 4 chambers, some PAR missing """
+    rng = np.random.RandomState(seed)
+    times = pd.date_range(START - pd.Timedelta("1D"), periods=ntimes,
+                          freq="30min", name="DateTime_hr")
+    chambers = ["C01", "C02", "C03", "C04"]
+    df = pd.DataFrame({
+        "chamber": pd.Categorical(np.repeat(chambers, ntimes)),
+        "HWtrt": pd.Categorical(np.repeat(["C", "HW", "C", "HW"], ntimes)),
+        "PAR": rng.uniform(0.0, 2000.0, 4 * ntimes),
+        "Tair_al": rng.uniform(15.0, 45.0, 4 * ntimes),
+    }, index=np.tile(times, 4))
+    df.index.name = "DateTime_hr"
+    df.iloc[rng.choice(len(df), 50, replace=False),
+            df.columns.get_loc("PAR")] = np.nan
+
+    return df
+
+def make_flux(ntimes=300, seed=0):
+    """ 15 min flux file rows of 4 chambers, in time order """
+    rng = np.random.RandomState(seed)
+    times = pd.date_range(START, periods=ntimes, freq="15min")
+    n = 4 * ntimes
+    chamber = np.tile(["C01", "C02", "C03", "C04"], ntimes)
+    HWtrt = np.tile(["C", "HW", "C", "HW"], ntimes)
+    T_treatment = np.tile(["ambient", "ambient", "elevated", "elevated"],
+                          ntimes)
+    return pd.DataFrame({
+        "DateTime_hr": np.repeat(times, 4).strftime("%Y-%m-%d %H:%M:%S"),
+        "chamber": chamber, "T_treatment": T_treatment, "HWtrt": HWtrt,
+        "combotrt": [t + "_" + h for t, h in zip(T_treatment, HWtrt)],
+        "PAR": rng.uniform(0.0, 2000.0, n),
+        "Tair_al": rng.uniform(15.0, 45.0, n),
+        "VPD": rng.uniform(0.5, 6.0, n),
+        "TargTempC_Avg": rng.uniform(15.0, 45.0, n),
+        "Photo": rng.uniform(-2.0, 15.0, n),
+        "Trans": rng.uniform(0.0, 4.0, n),
+    })
+
+class TestChamberIndex(unittest.TestCase):
+
+    def setUp(self):
+        self.wtc_m = make_chamber_means()
+        self.index = ChamberIndex(self.wtc_m)
+
+    def check(self, got, expected):
+        key = ["HWtrt", "chamber", "DateTime_hr"]
+        got = got.reset_index().sort_values(key).reset_index(drop=True)
+        expected = (expected.reset_index().sort_values(key)
+                    .reset_index(drop=True)[got.columns])
+        pd.testing.assert_frame_equal(got, expected, check_categorical=False)
+
+    def test_par_limit(self):
+        # same as the boolean mask it replaced, i.e. missing PAR is dropped
+        for HWtrt in ("C", "HW"):
+            df = self.wtc_m
+            expected = df[(df.HWtrt == HWtrt) & (df.index >= START) &
+                          (df.index <= END) & (df.PAR > 600)]
+            got = self.index.select(HWtrt, START, END, 600)
+            self.assertFalse(got.PAR.isna().any())
+            self.check(got, expected)
+
+    def test_no_limit(self):
+        df = self.wtc_m
+        self.check(self.index.select("HW"), df[df.HWtrt == "HW"])
+
+    def test_screen(self):
+        df = self.wtc_m
+        got = self.index.select(None, START, END, 600)
+        self.check(got, wtc_data.screen(df, 600))
+
+class TestZip(unittest.TestCase):
+    """ Reading the flux CSV straight out of the data package zip """
+
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.csv = os.path.join(self.tmp, "flux.csv")
+        make_flux().to_csv(self.csv, index=False)
+
+        self.archive = os.path.join(self.tmp, "pkg", "pkg.zip")
+        os.makedirs(os.path.dirname(self.archive))
+        with zipfile.ZipFile(self.archive, "w") as z:
+            z.write(self.csv, "data/flux.csv")
+            z.writestr("data/other.csv", "x\n1\n")
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp)
+
+    def test_split_zip(self):
+        member = self.archive + "/data/flux.csv"
+        self.assertEqual(wtc_data.split_zip(member),
+                         (self.archive, "data/flux.csv"))
+        # matched on the file name
+        self.assertEqual(wtc_data.split_zip(self.archive + "/flux.csv"),
+                         (self.archive, "data/flux.csv"))
+        self.assertEqual(wtc_data.split_zip(self.csv), (None, self.csv))
+        with self.assertRaises(KeyError):
+            wtc_data.split_zip(self.archive + "/missing.csv")
+
+    def test_read_file(self):
+        expected = wtc_data.read_file(self.csv, wtc_data.MODEL_COLUMNS)
+        for fname in (self.archive + "/data/flux.csv",
+                      self.archive + "/flux.csv"):
+            got = wtc_data.read_file(fname, wtc_data.MODEL_COLUMNS)
+            pd.testing.assert_frame_equal(got, expected)
+
+    def test_separate_caches(self):
+        # the CSV & the zip next to it don't clear each other's caches
+        if wtc_data.pyarrow is None:
+            self.skipTest("no parquet cache without pyarrow")
+        shutil.copy(self.archive, self.tmp)
+        archive = os.path.join(self.tmp, "pkg.zip")
+        for fname in (self.csv, archive + "/flux.csv", self.csv):
+            wtc_data.read_file(fname, wtc_data.MODEL_COLUMNS)
+        cache_fnames = [wtc_data.get_cache_fname(f)
+                        for f in (self.csv, archive + "/flux.csv")]
+        self.assertNotEqual(cache_fnames[0], cache_fnames[1])
+        for f in cache_fnames:
+            self.assertTrue(os.path.exists(f))
+
+    def test_iter_chamber_means(self):
+        expected = pd.concat(list(wtc_data.iter_chamber_means(self.csv,
+                                                              chunksize=77)))
+        got = pd.concat(list(wtc_data.iter_chamber_means(\
+                                self.archive + "/flux.csv", chunksize=77)))
+        pd.testing.assert_frame_equal(got, expected)
+
+if __name__ == "__main__":
+
+    unittest.main()
@@ -0,0 +1,523 @@
+#!/usr/bin/env python
+
+"""
+Shared reading and filtering of the WTC flux data used by the plot scripts.
+
+The first read of the flux CSV writes a typed parquet copy next to it, so
+later runs skip parsing the text and only load the columns they need.
+
+The CSV can also be read straight out of the downloaded data package without
+extracting it, by giving the path inside the zip, e.g.
+
+    read_file("WTC_TEMP-PARRA_HEATWAVE-FLUX-PACKAGE_L1.zip/" + FNAME)
+"""
+
+import os
+import glob
+import zipfile
+import numpy as np
+import pandas as pd
+
+from profiler import stage
+
+try:
+    import pyarrow
+except ImportError:
+    pyarrow = None
+
+__author__  = "Martin De Kauwe"
+__version__ = "1.0 (18.10.2026)"
+__email__   = "mdekauwe@gmail.com"
+
+FDIR = "raw_data"
+FNAME = "WTC_TEMP-PARRA_CM_WTCFLUX-CANOPYTEMP_20161029-20161115_L0.csv"
+
+CATEGORICAL = ["chamber", "T_treatment", "HWtrt", "combotrt"]
+
+# What the model comparison plots use
+MODEL_COLUMNS = CATEGORICAL + ["PAR", "Tair_al", "VPD", "TargTempC_Avg",
+                               "Photo", "Trans"]
+
+# Treatment of each chamber
+TREATMENTS = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                          "treatments.csv")
+
+# Experiment period
+START = pd.Timestamp('2016-10-20 00:00:00')
+END = pd.Timestamp('2016-11-11 20:00:00')
+
+# Chamber indexes already built this session, see get_chamber_index
+_INDEXES = {}
+
+def read_file(fname, columns=None):
+    """
+    Read the WTC flux file, via the parquet cache if we can.
+
+    Parameters:
+    ----------
+    fname : string
+        path to the WTC flux CSV
+    columns : list
+        only return these columns (DateTime_hr is always returned), None
+        for everything
+
+    Returns:
+    --------
+    df : dataframe
+        fluxes indexed by date
+    """
+    if columns is not None:
+        columns = ["DateTime_hr"] + [v for v in columns if v != "DateTime_hr"]
+
+    if pyarrow is None:
+        with stage("parse_csv"):
+            df = parse_csv(fname, columns)
+    else:
+        cache_fname = get_cache_fname(fname)
+        if not os.path.exists(cache_fname):
+            # drop caches of older versions of the file, but not the one
+            # another process may have just written
+            for f in glob.glob(get_cache_fname(fname, key="*")):
+                if f == cache_fname:
+                    continue
+                try:
+                    os.remove(f)
+                except FileNotFoundError:
+                    pass
+            with stage("parse_csv"):
+                write_parquet(parse_csv(fname), cache_fname)
+        with stage("read_parquet"):
+            df = pd.read_parquet(cache_fname, columns=columns)
+
+    return add_dates(df)
+
+def write_parquet(df, fname):
+    """
+    Write df to fname via a temporary file next to it, so an interrupted
+    write (or another run reading it) never sees a partial file
+    """
+    tmp_fname = "%s.%d.tmp" % (fname, os.getpid())
+    try:
+        df.to_parquet(tmp_fname)
+        os.replace(tmp_fname, fname)
+    finally:
+        if os.path.exists(tmp_fname):
+            os.remove(tmp_fname)
+
+def iter_chamber_means(fname, freq="30min", columns=None, chunksize=100000,
+                       keys=CATEGORICAL):
+    """
+    Streaming equivalent of get_chamber_means(read_file(fname)), reading the
+    CSV chunksize rows at a time so memory doesn't grow with the length of
+    the record. Each chamber's rows need to be in time order, though the
+    chambers can be interleaved (a time ordered file) or one after another:
+    the rows in a chamber's last time bin of a chunk are held back until
+    the next chunk, as that bin may not be complete yet.
+
+    Parameters:
+    ----------
+    fname : string
+        path to the WTC flux CSV
+    freq : string
+        pandas frequency of the bins, e.g. "30min" or "60min"
+    columns : list
+        only read these columns (DateTime_hr is always read)
+    chunksize : int
+        number of CSV rows to read at a time
+    keys : list
+        columns identifying a chamber
+
+    Yields:
+    -------
+    wtc_m : dataframe
+        chamber means for the bins completed by each chunk
+
+    Raises:
+    -------
+    ValueError
+        if a chamber has rows in a bin that has already been yielded, i.e.
+        its rows aren't in time order
+    """
+    if columns is not None:
+        columns = ["DateTime_hr"] + [v for v in columns if v != "DateTime_hr"]
+
+    # last bin yielded for each chamber
+    flushed = {}
+    carry = None
+    for chunk in parse_csv(fname, columns, chunksize=chunksize):
+        if carry is not None:
+            chunk = pd.concat([carry, chunk])
+        chunk = add_dates(chunk)
+
+        bins = pd.Series(chunk.index.round(freq), index=np.arange(len(chunk)))
+        chambers = [chunk[k].to_numpy() for k in keys]
+        by_chamber = bins.groupby(chambers, observed=True)
+        for key, first in by_chamber.min().items():
+            if key in flushed and first <= flushed[key]:
+                raise ValueError("%s isn't in time order: %s has rows in "
+                                 "the %s bin after it was done" %
+                                 (fname, key, first))
+
+        keep = (bins < by_chamber.transform("max")).to_numpy()
+        carry = chunk[~keep]
+        chunk = chunk[keep]
+        if len(chunk) > 0:
+            flushed.update(bins[keep].groupby([v[keep] for v in chambers],
+                                              observed=True).max())
+            yield get_chamber_means(chunk, freq, keys)
+
+    if carry is not None and len(carry) > 0:
+        yield get_chamber_means(carry, freq, keys)
+
+def parse_csv(fname, columns=None, chunksize=None):
+
+    dtypes = {v: "category" for v in CATEGORICAL}
+    if chunksize is not None:
+        return iter_csv(fname, columns, dtypes, chunksize)
+
+    (archive, member) = split_zip(fname)
+    if archive is None:
+        return parse_dates(pd.read_csv(fname, usecols=columns, dtype=dtypes))
+
+    with zipfile.ZipFile(archive) as z, z.open(member) as f:
+        return parse_dates(pd.read_csv(f, usecols=columns, dtype=dtypes))
+
+def iter_csv(fname, columns, dtypes, chunksize):
+
+    (archive, member) = split_zip(fname)
+    if archive is None:
+        for df in pd.read_csv(fname, usecols=columns, dtype=dtypes,
+                              chunksize=chunksize):
+            yield parse_dates(df)
+    else:
+        with zipfile.ZipFile(archive) as z, z.open(member) as f:
+            for df in pd.read_csv(f, usecols=columns, dtype=dtypes,
+                                  chunksize=chunksize):
+                yield parse_dates(df)
+
+def split_zip(fname):
+    """
+    Split a path inside a zip, e.g. "pkg.zip/data/x.csv", into the archive
+    and the member, which is matched on its file name if it isn't an exact
+    path in the archive. (None, fname) for a plain file.
+    """
+    parts = fname.replace(os.sep, "/").split("/")
+    for i in range(1, len(parts)):
+        archive = "/".join(parts[:i])
+        if archive.lower().endswith(".zip") and os.path.isfile(archive):
+            member = "/".join(parts[i:])
+            with zipfile.ZipFile(archive) as z:
+                names = z.namelist()
+            if member not in names:
+                matches = [v for v in names
+                           if v.split("/")[-1] == parts[-1]]
+                if not matches:
+                    raise KeyError("%s isn't in %s" % (member, archive))
+                member = matches[0]
+            return (archive, member)
+
+    return (None, fname)
+
+def parse_dates(df):
+    df['DateTime_hr'] = pd.to_datetime(df['DateTime_hr'],
+                                       format='%Y-%m-%d %H:%M:%S')
+    return df
+
+def add_dates(df):
+    df.index = pd.DatetimeIndex(df["DateTime_hr"], name="dates")
+    df["year"] = df.index.year
+    df["month"] = df.index.month
+    df["day"] = df.index.day
+    df["doy"] = df.index.dayofyear
+    df["hour"] = df.index.hour
+
+    return df
+
+def get_cache_fname(fname, key=None):
+    """
+    Cache file is keyed on the size & modification time of the CSV (or the
+    zip it is in, with the cache next to the zip). The kind of source is in
+    the name too, so a CSV and a zip of it in the same directory don't
+    share (and clear) each other's caches
+    """
+    (archive, member) = split_zip(fname)
+    if archive is not None:
+        fname = os.path.join(os.path.dirname(archive),
+                             os.path.basename(member))
+
+    if key is None:
+        st = os.stat(fname if archive is None else archive)
+        key = "%d-%d" % (st.st_size, st.st_mtime_ns)
+
+    return "%s.%s.%s.parquet" % (os.path.splitext(fname)[0],
+                                 "csv" if archive is None else "zip", key)
+
+def get_model_data(fname, PARlimit=600, columns=MODEL_COLUMNS):
+    """
+    Half-hourly chamber means of the experiment, split into control and
+    heatwave chambers and screened for high light, i.e. the data we compare
+    the model against.
+
+    Parameters:
+    ----------
+    fname : string
+        path to the WTC flux file
+    PARlimit : float
+        only keep timesteps with PAR above this (umol m-2 s-1)
+    columns : list
+        columns to read from the flux file
+
+    Returns:
+    --------
+    df_ct : dataframe
+        control chambers
+    df_hw : dataframe
+        heatwave chambers
+    """
+    index = get_chamber_index(fname, "30min", columns)
+    df_ct = index.select("C", START, END, max(10.0, PARlimit))
+    df_hw = index.select("HW", START, END, max(10.0, PARlimit))
+
+    return (df_ct, df_hw)
+
+def get_chamber_index(fname, freq="30min", columns=MODEL_COLUMNS):
+    """
+    ChamberIndex of the chamber means of fname, only built once per session
+    for each file, frequency & set of columns
+    """
+    key = (os.path.abspath(fname), freq,
+           None if columns is None else tuple(columns))
+    if key not in _INDEXES:
+        wtc = read_file(fname, columns)
+        _INDEXES[key] = ChamberIndex(get_chamber_means(wtc, freq))
+
+    return _INDEXES[key]
+
+class ChamberIndex(object):
+    """
+    Chamber means sorted on a (HWtrt, chamber, DateTime_hr) MultiIndex, so
+    treatment & date selections are index lookups rather than boolean scans
+    of whole columns. PAR thresholds use a presorted copy of PAR. Views are
+    cached, so treat them as read only.
+    """
+
+    def __init__(self, wtc_m, levels=("HWtrt", "chamber")):
+
+        levels = list(levels)
+        df = wtc_m.set_index(levels, append=True)
+        df = df.reorder_levels(levels + [wtc_m.index.name]).sort_index()
+        self.index = df.index
+        self.levels = levels
+
+        # the views look like the chamber means, i.e. indexed by time
+        self.df = df.reset_index(levels)
+        self.df.index = self.index.get_level_values(-1)
+
+        par = self.df["PAR"].to_numpy() if "PAR" in self.df else None
+        if par is not None:
+            # rows with missing PAR never pass a threshold, as with PAR > x
+            finite = np.flatnonzero(np.isfinite(par))
+            self.par_order = finite[np.argsort(par[finite], kind="stable")]
+            self.par_sorted = par[self.par_order]
+
+        self.views = {}
+
+    def select(self, HWtrt=None, start=None, end=None, PARlimit=None,
+               chamber=None):
+        """
+        Parameters:
+        ----------
+        HWtrt : string or list
+            heatwave treatment(s), None for all
+        start, end : timestamp or string
+            inclusive date range, None for open ended
+        PARlimit : float
+            only keep timesteps with PAR above this (umol m-2 s-1)
+        chamber : string or list
+            chamber(s), None for all
+
+        Returns:
+        --------
+        df : dataframe
+            chamber means (sorted by treatment, chamber & time)
+        """
+        key = tuple(tuple(v) if isinstance(v, list) else v
+                    for v in (HWtrt, start, end, PARlimit, chamber))
+        if key not in self.views:
+            self.views[key] = self.df.iloc[self.locate(HWtrt, start, end,
+                                                       PARlimit, chamber)]
+
+        return self.views[key]
+
+    def locate(self, HWtrt=None, start=None, end=None, PARlimit=None,
+               chamber=None):
+        """ Sorted row positions of a selection """
+        if HWtrt is None and chamber is None and start is None and end is None:
+            pos = np.arange(len(self.index))
+        else:
+            sel = [slice(None) if v is None else v for v in (HWtrt, chamber)]
+            if start is None and end is None:
+                sel.append(slice(None))
+            else:
+                sel.append(slice(None if start is None else pd.Timestamp(start),
+                                 None if end is None else pd.Timestamp(end)))
+            pos = self.index.get_locs(sel)
+
+        if PARlimit is not None:
+            i = np.searchsorted(self.par_sorted, PARlimit, side="right")
+            pos = np.intersect1d(pos, self.par_order[i:], assume_unique=True)
+
+        return pos
+
+    def __len__(self):
+        return len(self.df)
+
+def screen(wtc_m, PARlimit=600):
+    """ Keep the experiment period and high light timesteps """
+    wtc_m = wtc_m[(wtc_m.index >= START) & (wtc_m.index <= END)]
+
+    return wtc_m[(wtc_m["PAR"] > 10.0) & (wtc_m["PAR"] > PARlimit)]
+
+def get_chamber_means(wtc, freq="30min", keys=CATEGORICAL):
+    """
+    Average the fluxes of each chamber into freq time bins, i.e. timestamps
+    are rounded to the nearest bin.
+
+    Parameters:
+    ----------
+    wtc : dataframe
+        fluxes indexed by date, from read_file
+    freq : string
+        pandas frequency of the bins, e.g. "30min" or "60min"
+    keys : list
+        columns identifying a chamber
+
+    Returns:
+    --------
+    wtc_m : dataframe
+        mean of the numeric columns for each chamber & bin, indexed by
+        DateTime_hr
+    """
+    with stage("round_times"):
+        bins = wtc.index.round(freq).rename("DateTime_hr")
+    with stage("groupby"):
+        wtc_m = wtc.drop(columns="DateTime_hr").groupby([bins] + list(keys),
+                                                        observed=True)
+        wtc_m = wtc_m.mean(numeric_only=True).reset_index(list(keys))
+
+    return wtc_m
+
+def get_treatment_means(wtc_m, columns, by="HWtrt"):
+    """
+    Mean, standard error & count of the chamber means in each treatment &
+    time bin, from a grouped sum of the values and the number of valid
+    values, then of the squared deviations from each bin's mean (rather
+    than of the squares, which cancel badly for large values).
+
+    Parameters:
+    ----------
+    wtc_m : dataframe
+        chamber means indexed by time, from get_chamber_means
+    columns : list
+        fluxes to aggregate
+    by : string or list
+        treatment column(s) to group the chambers by
+
+    Returns:
+    --------
+    stats : dataframe
+        indexed by (time, treatment), with the mean of each column under
+        its own name and the SEM and count as <column>_sem and <column>_n
+    """
+    by = [by] if isinstance(by, str) else list(by)
+    x = wtc_m[columns].astype(np.float64)
+    valid = x.notna()
+    x = x.fillna(0.0)
+    parts = pd.concat([x, valid.astype(np.float64)], axis=1,
+                      keys=["sum", "n"])
+
+    groups = parts.groupby([wtc_m.index] + [wtc_m[v] for v in by],
+                           observed=True, sort=True)
+    sums = groups.sum()
+    (total, n) = [sums[v].to_numpy() for v in ["sum", "n"]]
+    with np.errstate(invalid="ignore", divide="ignore"):
+        mean = total / n
+
+    # bin of each row, in the order of sums
+    codes = groups.ngroup().to_numpy()
+    dev = np.where(valid.to_numpy(), x.to_numpy() - mean[codes], 0.0)
+    ssd = np.column_stack([np.bincount(codes, weights=dev[:,j]**2,
+                                       minlength=len(sums))
+                           for j in range(len(columns))])
+
+    with np.errstate(invalid="ignore", divide="ignore"):
+        var = ssd / (n - 1.0)
+        sem = np.sqrt(var / n)
+
+    stats = pd.concat([pd.DataFrame(mean, index=sums.index, columns=columns),
+                       pd.DataFrame(sem, index=sums.index,
+                                    columns=[v + "_sem" for v in columns]),
+                       pd.DataFrame(n.astype(np.int64), index=sums.index,
+                                    columns=[v + "_n" for v in columns])],
+                      axis=1)
+
+    return stats
+
+def read_treatments(fname=TREATMENTS):
+    """
+    Treatment table, one row per chamber with its T_treatment and HWtrt as
+    categoricals (note the heatwave treatment of C08 and C12 was swapped)
+    """
+    table = pd.read_csv(fname, dtype="category")
+
+    return table.set_index("chamber")
+
+def add_treatments(df, treatments=None):
+    """
+    Attach the treatments of each chamber to df, as categoricals. Rows are
+    mapped by indexing the treatment table with the chamber codes, rather
+    than merging, and combotrt (T_treatment_HWtrt) is built from the codes.
+
+    Parameters:
+    ----------
+    df : dataframe
+        with a categorical chamber column
+    treatments : dataframe
+        from read_treatments, None for the default table
+
+    Returns:
+    --------
+    df : dataframe
+        with T_treatment, HWtrt and combotrt columns
+    """
+    if treatments is None:
+        treatments = read_treatments()
+
+    chamber = df["chamber"].astype("category")
+    lookup = treatments.index.get_indexer(chamber.cat.categories)
+    if (lookup < 0).any():
+        missing = chamber.cat.categories[lookup < 0].tolist()
+        raise KeyError("No treatment for chambers %s" % (missing))
+    rows = lookup[chamber.cat.codes.to_numpy()]
+
+    codes = {}
+    for col in ["T_treatment", "HWtrt"]:
+        codes[col] = treatments[col].cat.codes.to_numpy()[rows]
+        df[col] = pd.Categorical.from_codes(codes[col],
+                                            treatments[col].cat.categories)
+
+    (t_cats, hw_cats) = [treatments[col].cat.categories
+                         for col in ["T_treatment", "HWtrt"]]
+    combo = ["%s_%s" % (t, hw) for t in t_cats for hw in hw_cats]
+    df["combotrt"] = pd.Categorical.from_codes(codes["T_treatment"] *
+                                               len(hw_cats) + codes["HWtrt"],
+                                               combo)
+
+    return df
+
+def get_fname(fdir=FDIR, archive=None):
+    """ Path to the flux CSV, in fdir or inside the data package zip """
+    if archive is not None:
+        return os.path.join(archive, FNAME)
+
+    return os.path.join(fdir, FNAME)